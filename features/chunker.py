@@ -0,0 +1,150 @@
+__author__ = 'mihaileric/chrisbillovits'
+
+''' Compiled tag-pattern chunker for the phrase templates.
+
+    The NN-PHRASE / VB-PHRASE grammar used to go through nltk.RegexpParser
+    for both sentences on every call of the noun phrase templates.  Here
+    it is compiled once: every tag pattern (<NN>, <DT.*>, ...) is matched
+    against each distinct Penn tag only once, giving the tag a bit mask of
+    the patterns it matches.  Rules needing a pattern that no tag of the
+    sentence matches are skipped outright, and the others are checked
+    against the masks of consecutive tokens.  Rules are applied in
+    grammar order, leftmost first and never over an existing chunk, and
+    each labelled section chunks the output of the one before it, as
+    RegexpParser does.  Only chunk rules ({...}) are supported.  '''
+
+import re
+import numpy as np
+
+phrase_grammar = """ \
+            NN-PHRASE: {<DT.*> <NN> <RB>}
+                      { <JJ> <NN>}
+                      {<NN> <IN> <NN>}
+                      {<RB> <JJ> <NN>}
+                      { <NNS> <RB>}
+                      { <JJ> <NNS>}
+                      {<NNS> <IN> <NNS>}
+                      {<RB> <JJ> <NNS>}
+                      { <NNP> <RB>}
+                      { <JJ> <NNP>}
+                      {<NNP> <IN> <NNP>}
+                      {<RB> <JJ> <NNP>}
+                      { <NNPS> <RB>}
+                      {<DT.*> <JJ> <NNPS>}
+                      {<NNPS> <IN> <NNP>}
+                      {<RB> <JJ> <NNPS>}
+                      {<NN> <VBZ> <VBG>}
+                      {<NNS> <VBZ> <VBG>}
+                      {<NN> <VBP> <VBG>}
+                      {<NNS> <VBP> <VBG>}
+
+            VB-PHRASE : {<RB> <VB>}
+                        {<RB> <VBD>}
+                        {<RB> <VBG>}
+                        {<RB> <VBN>}
+                        {<RB> <VBP>}
+                        {<RB> <VBZ>}
+                        {<RBR> <VB>}
+                        {<RBR> <VBD>}
+                        {<RBR> <VBG>}
+                        {<RBR> <VBN>}
+                        {<RBR> <VBP>}
+                        {<RBR> <VBZ>}
+                        {<RBS> <VB>}
+                        {<RBS> <VBD>}
+                        {<RBS> <VBG>}
+                        {<RBS> <VBN>}
+                        {<RBS> <VBP>}
+                        {<RBS> <VBZ>}
+                        {<VBG> <IN> <DT> <NN>}
+                        {<VBG> <IN> <DT> <NNS>}
+
+          """
+
+class TagChunker(object):
+    ''' A RegexpParser grammar of chunk rules, compiled for tag sequences. '''
+
+    def __init__(self, grammar):
+        self.patterns = []
+        self.stages = [] # (label, [(tuple of pattern ids, mask of the ids) per rule])
+        pattern_ids = {}
+        for line in grammar.split('\n'):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            if ':' in line:
+                label, line = line.split(':', 1)
+                self.stages.append((label.strip(), []))
+            if not self.stages:
+                raise ValueError('chunk rule before any label: {0}'.format(line))
+            rules = re.findall(r'\{([^{}]*)\}', line)
+            if re.sub(r'\{([^{}]*)\}', '', line).strip():
+                raise ValueError('only chunk rules are supported: {0}'.format(line))
+            for rule in rules:
+                ids = []
+                for pattern in re.findall(r'<([^<>]*)>', rule):
+                    pattern = re.sub(r'\s+', '', pattern)
+                    if pattern not in pattern_ids:
+                        pattern_ids[pattern] = len(self.patterns)
+                        self.patterns.append(re.compile('(?:{0})$'.format(pattern.replace('.', '[^{}<>]'))))
+                    ids.append(pattern_ids[pattern])
+                self.stages[-1][1].append((tuple(ids), sum(set(1 << i for i in ids))))
+        self._tag_masks = {}
+
+    def _tag_mask(self, tag):
+        ''' Bit mask of the patterns the tag matches. '''
+        try:
+            return self._tag_masks[tag]
+        except KeyError:
+            mask = self._tag_masks[tag] = sum(1 << i for i, p in enumerate(self.patterns) if p.match(tag))
+            return mask
+
+    def chunk(self, tags):
+        ''' Chunks of the tag sequence, as a dict from label to an (n, 2)
+            array of (start, end) token spans, in sentence order. '''
+        tags = list(tags)
+        spans = [(i, i + 1) for i in xrange(len(tags))]
+        found = {}
+        for label, rules in self.stages:
+            if not tags:
+                break
+            masks = [self._tag_mask(tag) for tag in tags]
+            present = 0
+            for mask in masks:
+                present |= mask
+            covered = [False] * len(tags)
+            chunks = []
+            for rule, needed in rules:
+                if needed & present != needed:
+                    continue
+                width = len(rule)
+                start = 0
+                while start + width <= len(tags):
+                    if (not any(covered[start:start + width]) and
+                            all(masks[start + k] >> pattern & 1 for k, pattern in enumerate(rule))):
+                        covered[start:start + width] = [True] * width
+                        chunks.append((start, start + width))
+                        start += width
+                    else:
+                        start += 1
+            if not chunks:
+                continue
+            chunks.sort()
+            found.setdefault(label, []).extend((spans[start][0], spans[end - 1][1]) for start, end in chunks)
+            # The next section sees each chunk as a single token tagged with the label.
+            chunk_at = dict(chunks)
+            next_tags, next_spans = [], []
+            i = 0
+            while i < len(tags):
+                if i in chunk_at:
+                    next_tags.append(label)
+                    next_spans.append((spans[i][0], spans[chunk_at[i] - 1][1]))
+                    i = chunk_at[i]
+                else:
+                    next_tags.append(tags[i])
+                    next_spans.append(spans[i])
+                    i += 1
+            tags, spans = next_tags, next_spans
+        return dict((label, np.array(sorted(chunks), dtype = np.int64)) for label, chunks in found.iteritems())
+
+phrase_chunker = TagChunker(phrase_grammar)
@@ -0,0 +1,78 @@
+__author__ = 'chrisbillovits'
+
+''' Cross-product features without per-pair Python objects.
+
+    A cross-product template used to build a Counter of (w1, w2) tuples,
+    |s1| x |s2| of them per example, whose names were hashed again when
+    vectorized.  Here the tokens of each side are mapped to integer ids,
+    the pair ids are an outer product of the two id arrays, and np.unique
+    counts them.  The result, a PairCounts, keeps the distinct tokens of
+    both sides and the (left id, right id, count) triples; a vocabulary
+    turns it into matrix columns in bulk (see features/vectorize.py), and
+    the (w1, w2) names are only built for pairs it has not seen yet.  '''
+
+import numpy as np
+
+def _local_ids(tokens):
+    ''' Distinct tokens in order of first occurrence, and each token's index among them. '''
+    ids = {}
+    inverse = np.array([ids.setdefault(t, len(ids)) for t in tokens], dtype = np.int64)
+    distinct = [None] * len(ids)
+    for t, i in ids.iteritems():
+        distinct[i] = t
+    return distinct, inverse
+
+class PairCounts(object):
+    ''' Counts of the names (left[i], right[j]) for one example. '''
+
+    def __init__(self, left, right, i, j, counts):
+        self.left = left
+        self.right = right
+        self.i = i
+        self.j = j
+        self.counts = counts
+
+    def __len__(self):
+        return len(self.counts)
+
+    def names(self):
+        left, right = self.left, self.right
+        return [(left[a], right[b]) for a, b in zip(self.i.tolist(), self.j.tolist())]
+
+    def iteritems(self):
+        return iter(zip(self.names(), self.counts.tolist()))
+
+def pair_counts(tokens1, tokens2):
+    ''' PairCounts of itertools.product(tokens1, tokens2). '''
+    left, inverse1 = _local_ids(tokens1)
+    right, inverse2 = _local_ids(tokens2)
+    if not left or not right:
+        empty = np.zeros(0, dtype = np.int64)
+        return PairCounts(left, right, empty, empty, empty)
+    codes = (inverse1[:, np.newaxis] * len(right) + inverse2[np.newaxis, :]).ravel()
+    codes, counts = np.unique(codes, return_counts = True)
+    i, j = np.divmod(codes, len(right))
+    return PairCounts(left, right, i, j, counts)
+
+class FeatureRow(object):
+    ''' The features of one example, as template outputs in template order:
+        feature dicts (consecutive ones merged), PairCounts and
+        DenseFeatures (see features/dense.py).  Later parts override
+        earlier ones, as with dict.update. '''
+
+    def __init__(self):
+        self.parts = []
+
+    def add(self, part):
+        if not isinstance(part, dict):
+            self.parts.append(part)
+        else:
+            if not self.parts or not isinstance(self.parts[-1], dict):
+                self.parts.append({})
+            self.parts[-1].update(part)
+
+    def as_dict(self):
+        feat_dict = {}
+        for part in self.parts:
+            feat_dict.update(part if isinstance(part, dict) else part.iteritems())
+        return feat_dict
@@ -0,0 +1,59 @@
+__author__ = 'chrisbillovits'
+
+''' Fixed-width dense template outputs.
+
+    A template whose output always has the same columns (e.g. the 50
+    GloVe dimension differences of glv_diff) returns a DenseFeatures
+    instead of a dict.  When vectorizing, its values are written into a
+    preallocated float32 block rather than the vocabulary, and the rows
+    come out as a FeatureMatrix: the CSR part for the named features and
+    the dense block beside it.  The first pipeline step stacks the two
+    (see features/vectorize.py).  '''
+
+import numpy as np
+import scipy.sparse as sp
+
+class DenseFeatures(object):
+    ''' Values of a dense template, in the order of its declared column names. '''
+
+    def __init__(self, names, values):
+        self.names = names
+        self.values = values
+
+    def __len__(self):
+        return len(self.names)
+
+    def iteritems(self):
+        return iter(zip(self.names, self.values.tolist()))
+
+class FeatureMatrix(object):
+    ''' A CSR matrix and a dense float32 block with the same rows. '''
+
+    def __init__(self, sparse, dense):
+        self.sparse = sparse
+        self.dense = dense
+
+    @property
+    def shape(self):
+        return (self.sparse.shape[0], self.sparse.shape[1] + self.dense.shape[1])
+
+    def __len__(self):
+        return self.sparse.shape[0]
+
+    def __getitem__(self, rows):
+        return FeatureMatrix(self.sparse[rows], self.dense[rows])
+
+    def tocsr(self):
+        return with_dense(self.sparse, self.dense)
+
+def split_dense(X):
+    ''' (sparse part, dense block or None) of a matrix or FeatureMatrix. '''
+    if isinstance(X, FeatureMatrix):
+        return X.sparse, X.dense
+    return X, None
+
+def with_dense(X, dense):
+    ''' X with the dense block, if any, stacked to its right. '''
+    if dense is None:
+        return X
+    return sp.hstack([X, sp.csr_matrix(dense)], format = 'csr')
@@ -9,10 +9,11 @@ root_dir = os.path.dirname(os.path.dirname(__file__))
 sys.path.append(root_dir)
 
 from collections import Counter
-from framenet.fn_tools import is_super_frame
+from framenet.fn_tools import super_frame_pairs
 from framenet import frame
 import itertools
 import nltk
+from multiprocessing import Pool, cpu_count, current_process
 import csv
 from util.utils import *
 import numpy as np
@@ -21,42 +22,52 @@ from nltk import word_tokenize, pos_tag
 from nltk.corpus import wordnet as wn
 from nltk.stem import WordNetLemmatizer
 from util.colors import color, prettyPrint
-from util.distributedwordreps import build, cosine
+from util.distributedwordreps import cosine
+from util.glove import GloveStore
+from util.wordnet_cache import wordnet
+from util.hypernyms import hypernym_index
+from sentence import Sentence, analyze, penn2wn, tag_tokens
+from crossproduct import FeatureRow, pair_counts
+from dense import DenseFeatures
+from template_profile import TemplateProfile
+from timeit import default_timer as _timer
 
 lemmatizer = WordNetLemmatizer()
 
 _glv_dim = 50
-GLOVE_MAT, GLOVE_VOCAB = np.zeros(_glv_dim), np.zeros(_glv_dim)
+GLOVE = None
+
+# Feature names of the dense templates, formatted once instead of per example
+_glv_dim_keys = ['glv_dim_diff' + str(i) for i in range(_glv_dim)]
+_aligned_dim_keys = {}
+_glv_depth_keys = {}
 
 GLV_CACHE = {}
 
 def glvvec(w):
 
     """Return the GloVe vector for w."""
-    global GLOVE_MAT, GLOVE_VOCAB, GLV_CACHE
+    global GLV_CACHE
     if w in GLV_CACHE:
         return GLV_CACHE[w]
-    if not GLOVE_MAT.any():
-        init_glv()
-
-    try:
-        i = GLOVE_VOCAB.index(w)
-        GLV_CACHE[w] = GLOVE_MAT[i]
-        
-    except ValueError:
-        GLV_CACHE[w] = np.zeros(_glv_dim)
-
+    init_glv()
+    GLV_CACHE[w] = GLOVE.vector(w)
     return GLV_CACHE[w]
 
+def glvvecs(words):
+    """Return the (len(words) x dim) matrix of GloVe vectors for words."""
+    init_glv()
+    return GLOVE.lookup(words)
+
 def init_glv():
 
-    global GLOVE_MAT, GLOVE_VOCAB
-    if GLOVE_MAT.any():
+    global GLOVE
+    if GLOVE is not None:
         return
     ''' Lazily initializes GloVe vectors if they don't already exist '''
     prettyPrint("Building GloVe vectors: ", color.CYAN)
-    GLOVE_MAT, GLOVE_VOCAB, _ = build(root_dir + '/nli-data/glove.6B.{0}d.txt'.format(_glv_dim), delimiter=' ', header=False, quoting=csv.QUOTE_NONE)
-    prettyPrint("Loaded vectors, dimension {0} ".format(np.shape(GLOVE_MAT)[1]), color.CYAN)
+    GLOVE = GloveStore(root_dir + '/nli-data/glove.6B.{0}d.txt'.format(_glv_dim))
+    prettyPrint("Loaded vectors, dimension {0} ".format(GLOVE.dim), color.CYAN)
 
 def weighted_glv(tree):
     ''' Weigh the vector importance on compositionality.
@@ -67,35 +78,21 @@ def weighted_glv(tree):
     #global GLOVE_MAT, GLOVE_VOCAB
     init_glv()
 
-    words = []      # (word, height in tree)
-    depthSize = {}  # L1 norm of tree depths
-    depthSize['count'] = 0
-
-    def extract_words(subtree, n):
-
-        for phrase in subtree:
-            if isinstance(phrase,tuple):
-                extract_words(phrase, n+1)
-            else:
-                words.append((phrase, n))
-                depthSize['count'] += n
+    s = analyze(tree)
+    depthSize = sum(s.depths)  # L1 norm of tree depths
 
-    extract_words(tree, 1)
-
-    word_leaves = [ 1.0 * w[1] / depthSize['count'] * glvvec(w[0]) for w in words if glvvec(w[0]).any()]
+    word_leaves = [ 1.0 * n / depthSize * glvvec(w) for w, n in zip(s.tokens, s.depths) if glvvec(w).any()]
     return word_leaves
 
 def compare_glv_trees(t1, t2):
-    ''' Emits a vector of features for the difference of words, discriminated on POS tag.'''
-    features = {}
+    ''' Emits a vector of features for the difference of words, discriminated on POS tag.
+        Dense: always the _glv_dim columns of _glv_dim_keys. '''
     leaves1 = weighted_glv(t1)
     leaves2 = weighted_glv(t2)
     # Normalize to [0, inf) for chi-squared test
     diff = np.exp(np.mean(leaves1, axis = 0) - np.mean(leaves2, axis = 0))
 
-    for i in range(np.shape(diff)[0]):
-        features['glv_dim_diff' + str(i)] = diff[i]
-    return features
+    return DenseFeatures(_glv_dim_keys, diff)
 
 def safe_cos(u, v):
     ''' Prevents overflow possible with scipy's cosine.  Assumes an array-like input u, v.'''
@@ -106,19 +103,45 @@ def safe_cos(u, v):
         measures for feature selection to fail '''  
     return cosine(u, v) + 1e-12
 
+def cosine_distances(u, v):
+    ''' Matrix of safe_cos distances between the rows of u and the rows of v,
+        from a single normalized matrix product. '''
+    nu, nv = np.linalg.norm(u, axis = 1), np.linalg.norm(v, axis = 1)
+    valid = np.outer(nu > 0, nv > 0)
+    nu[nu == 0], nv[nv == 0] = 1.0, 1.0
+    dist = 1.0 - np.dot(u / nu[:, np.newaxis], (v / nv[:, np.newaxis]).T) + 1e-12
+    dist[~valid] = 0.0
+    return np.maximum(dist, 0.0)
+
 def glv_cosine(t1, t2):
-    ''' Computes the word-wise feature difference via cosine, delineated by tree depth.'''
+    ''' Computes the word-wise feature difference via cosine, delineated by tree depth.
+        For every pair of depths (h1, h2), emits the max and the mean distance
+        between the words at depth h1 in t1 and the words at depth h2 in t2. '''
     features = {}
-    for word in leaves(t1):
-        h1 = word_depth(word, t1)
-        for token in leaves(t2):
-            h2 = word_depth(token, t2)
-            # Weight by tree compositionality (depth)
-            dist = safe_cos (glvvec(word), glvvec(token))
-            if dist < 0.:
-                print "ERR: distance less than 0: ", dist
-                
-            features["glv_depth {0} {1}".format(h1, h2)] = dist 
+    s1, s2 = analyze(t1), analyze(t2)
+    if not s1.tokens or not s2.tokens:
+        return features
+    # Weight by tree compositionality (depth)
+    dist = cosine_distances(glvvecs(s1.tokens), glvvecs(s2.tokens)).ravel()
+    d1, d2 = s1.tree.leaf_depths, s2.tree.leaf_depths
+    buckets = (d1[:, np.newaxis] * (d2.max() + 1) + d2[np.newaxis, :]).ravel()
+
+    codes, bucket_of = np.unique(buckets, return_inverse = True)
+    counts = np.bincount(bucket_of)
+    means = np.bincount(bucket_of, weights = dist) / counts
+    maxes = np.zeros(len(codes))
+    np.maximum.at(maxes, bucket_of, dist)
+
+    width = d2.max() + 1
+    for code, max_dist, mean_dist in zip(codes.tolist(), maxes.tolist(), means.tolist()):
+        h1, h2 = divmod(code, width)
+        try:
+            max_key, mean_key = _glv_depth_keys[(h1, h2)]
+        except KeyError:
+            max_key, mean_key = _glv_depth_keys[(h1, h2)] = ("glv_depth max {0} {1}".format(h1, h2),
+                                                             "glv_depth mean {0} {1}".format(h1, h2))
+        features[max_key] = max_dist
+        features[mean_key] = mean_dist
     return features
 
 def glv_window_overlap(t1, t2, n = 5):
@@ -132,8 +155,8 @@ def glv_window_overlap(t1, t2, n = 5):
         vectors within the (n - 1) gram context.  Produces dim * (n - 1) dense features.'''
 
     features = Counter()
-    v_tagged = pos_tag(leaves(t1))
-    w_tagged = pos_tag(leaves(t2))
+    v_tagged = analyze(t1).tagged
+    w_tagged = analyze(t2).tagged
 
     for v in ntuples(v_tagged, n):
         for w in ntuples(w_tagged, n):
@@ -149,8 +172,11 @@ def glv_window_overlap(t1, t2, n = 5):
                 for i, j in similar_align:
                     word_diff = np.exp ( glvvec( v[i][0]) - glvvec( w[j][0]) ) 
                     
-                    for dim in range(word_diff.shape[0]): 
-                        features[ v[i][1] + ' aligned dim ' +  str(dim)] += word_diff[dim]
+                    tag = v[i][1]
+                    if tag not in _aligned_dim_keys:
+                        _aligned_dim_keys[tag] = [tag + ' aligned dim ' + str(dim) for dim in range(_glv_dim)]
+                    for key, value in zip(_aligned_dim_keys[tag], word_diff.tolist()):
+                        features[key] += value
 
     return features
                 
@@ -169,18 +195,16 @@ def find_tagged_alignments(p, q, excluded):
              if pos_tags_equal(tw[1], tu[1]) and (i, j) not in excluded]
     
 def word_overlap_features(t1, t2):
-    overlap = [w1 for w1 in leaves(t1) if w1 in leaves(t2)]
+    s1, s2 = analyze(t1), analyze(t2)
+    overlap = [w1 for w1 in s1.tokens if w1 in s2.token_set]
 
     feat = Counter(overlap)
     feat['overlap_length'] = len(overlap)
-    feat['one_not_two_length'] = len([w1 for w1 in leaves(t1) if w1 not in leaves(t2)])
-    feat['two_not_one_length'] = len([w2 for w2 in leaves(t2) if w2 not in leaves(t1)])
+    feat['one_not_two_length'] = len(s1.tokens) - len(overlap)
+    feat['two_not_one_length'] = len([w2 for w2 in s2.tokens if w2 not in s1.token_set])
     
     return feat
 
-def word_cross_product_features(t1, t2):
-    return Counter([(w1, w2) for w1, w2 in itertools.product(leaves(t1), leaves(t2))])
-
 def ntuples(arr, n = 2):
     ''' Generator function for subarrays.  Centers never overlap. '''
     for i in range(0, len(arr) - n, n - 1):
@@ -193,98 +217,54 @@ def gen_ngrams(s, n = 2):
         yield ' '.join(s[i:i+n])
 
 
+_gram_overlap_keys = {n : '{0}gram_overlap'.format(n) for n in range(1, 5)}
+
 def gram_overlap(t1, t2, n = 2):
    
-    s1, s2 = leaves(t1), leaves(t2)
+    s1, s2 = analyze(t1).tokens, analyze(t2).tokens
     gen_1, gen_2 = [g for g in gen_ngrams(s1, n)], [g for g in gen_ngrams(s2, n)]
     gram_overlap = [g1 for g1 in gen_1
                     for g2 in gen_2 if g1 == g2]
     feat = Counter(gram_overlap) 
 
-    feat['{0}gram_overlap'.format(n)] = len(gram_overlap)
+    feat[_gram_overlap_keys[n]] = len(gram_overlap)
     '''feat['{0}gram_one_not_two_length'.format(n)] = len(s1) - len(gram_overlap)
        feat['{0}gram_two_not_one_length'.format(n)] = len(s2) - len(gram_overlap)
     '''                                                  
     return feat
        
 def gram_cross_product(t1, t2, n = 2):
-    s1, s2 = leaves(t1), leaves(t2)
-    return Counter([(g1, g2) for g1, g2 in itertools.product(gen_ngrams(s1, n),
-                                                              gen_ngrams(s2, n))])
+    s1, s2 = analyze(t1).tokens, analyze(t2).tokens
+    return pair_counts(list(gen_ngrams(s1, n)), list(gen_ngrams(s2, n)))
 
 def tree2sent(t1, t2):
-    return ' '.join(leaves(t1)), ' '.join(leaves(t2))
+    return analyze(t1).text, analyze(t2).text
 
 def length_features(t1, t2):
     feat = {}
-    feat['length_1'] = len(leaves(t1))
-    feat['length_2'] = len(leaves(t2))
+    feat['length_1'] = len(analyze(t1).tokens)
+    feat['length_2'] = len(analyze(t2).tokens)
     return feat
 
 def tree_depth(t):
-    curr_depth = 0
-    max_depth = 0
-    for ch in str(t):
-        if ch == '(':
-            curr_depth += 1
-        if ch == ')':
-            curr_depth -= 1
-        if curr_depth > max_depth:
-            max_depth = curr_depth
-    return max_depth
+    return analyze(t).depth
 
 def word_depth(word, t):
     ''' Returns the depth of a word in the tree.  -1 if it does not exist '''
-    tokens = leaves(t)
-    structured_sent = str(t)
-    if word not in tokens:
-        return -1
-    
-    depth = 0
-    word_ind = structured_sent.index(word)
-    for c in structured_sent[:word_ind]:
-        if c == '(':
-            depth += 1
-        elif c == ')':
-            depth -= 1
-    return depth
+    return analyze(t).word_depth.get(word, -1)
         
 def all_word_depth(t):
     ''' List of depths of words in the tree'''
-    depth = 0
-    depth_list = []
-    counter = 0
-    for ch in str(t):
-        if ch == '(':
-            depth += 1
-        elif ch == ')':
-            depth -= 1
-        elif ch == '\'':
-            if counter:
-                depth_list.append(depth)
-                counter = 0
-            else:
-                counter = 1
-        
-    return depth_list
+    return analyze(t).depths
           
 
 def tree_depth_features(t1, t2):
     feat = {}
-    feat['depth_1'] = tree_depth(t1)
-    feat['depth_2'] = tree_depth(t2)
+    feat['depth_1'] = analyze(t1).depth
+    feat['depth_2'] = analyze(t2).depth
     feat['depth_similarity'] = 1 - abs((feat['depth_1'] - feat['depth_2'])/(feat['depth_1'] + feat['depth_2']))
     return feat
 
-def penn2wn(tag):
-    """ Given a Penn Treebank tag, returns the appropriate 
-        WordNet tag, if possible.  Otherwise returns ''. """
-
-    if tag[0] in 'JVNR':
-        ind = 'JVNR'.index(tag[0]) # Starts with (AD)J, V(ERB), N(OUN), (ADVE)R(B)
-        return 'avnr'[ind]
-    return ''
-
 def pos_tags_equal(t, u, strategy = 'coarse'):
     ''' Based off of strategy, compares the two pos tags. '''
     if strategy == 'exact':
@@ -297,13 +277,13 @@ def pos_tags_equal(t, u, strategy = 'coarse'):
 def extract_nouns(sent):
     """Extracts nouns in a given sentence."""
     tokens = word_tokenize(sent)
-    pos_tagged = pos_tag(tokens)
+    pos_tagged = tag_tokens(tokens)
     return [word[0] for word in pos_tagged if word[1] == 'NN' or word[1] == 'NNS']
 
 def extract_nouns_lemma(sent):
     """Extracts lemmatized nouns in a given sentence."""
     tokens = word_tokenize(sent)
-    pos_tagged = pos_tag(tokens)
+    pos_tagged = tag_tokens(tokens)
     return [lemmatizer.lemmatize(word[0]) for word in pos_tagged if word[1] == 'NN' or word[1] == 'NNS']
 
 def extract_noun_synsets(sent):
@@ -311,7 +291,7 @@ def extract_noun_synsets(sent):
     synsets = []
     all_nouns = extract_nouns(sent)
     for noun in all_nouns:
-        synsets.extend(wn.synsets(noun, pos=wn.NOUN))
+        synsets.extend(wordnet.synsets(noun, pos=wn.NOUN))
     return synsets
 
 def extract_nouns_and_synsets(sent):
@@ -319,33 +299,33 @@ def extract_nouns_and_synsets(sent):
     synsets = []
     all_nouns = extract_nouns(sent)
     for noun in all_nouns:
-        synsets.extend(wn.synsets(noun, pos=wn.NOUN))
+        synsets.extend(wordnet.synsets(noun, pos=wn.NOUN))
     return (all_nouns, synsets)
 
 def extract_synsets (sent):
     ''' Extracts the synsets of all the words in the sentence with matching
         POS tag.  '''
     synsets = []
-    tagged = pos_tag(sent.split())
+    tagged = tag_tokens(sent.split())
     
     for word, pos in tagged:
-        synsets.extend(wn.synsets(word, pos=penn2wn(pos)))
+        synsets.extend(wordnet.synsets(word, pos=penn2wn(pos)))
     return synsets
 
 def noun_synset_dict(sent):
     synsets = {}
     all_nouns = extract_nouns(sent)
     for noun in all_nouns:
-        synsets[noun] = wn.synsets(noun, pos=wn.NOUN)
+        synsets[noun] = wordnet.synsets(noun, pos=wn.NOUN)
     return synsets
 
 def extract_lemmas(sent):
     """Extracts all adjectives in a given sentence"""
     lemmas = []
     tokens = word_tokenize(sent)
-    pos_tagged = pos_tag(tokens)
+    pos_tagged = tag_tokens(tokens)
     for word in pos_tagged:
-        lemmas.extend(wn.lemmas(word[0]))
+        lemmas.extend(wordnet.lemmas(word[0]))
     return lemmas
 
 def extract_adj_antonyms(sent):
@@ -360,17 +340,18 @@ def extract_adj_antonyms(sent):
 def synset_similarity(t1, t2):
     ''' Returns the closest similarity between sentences.
         TODO: Match this similarity with the number of overlap matches.  '''
-    l1, l2 = leaves(t1), leaves(t2)
+    s1, s2 = analyze(t1), analyze(t2)
+    l1, l2 = s1.tokens, s2.tokens
     # Get rid of all the matching words
-    overlap_size = len([w for w in l1 if w in l2])
+    overlap_size = len([w for w in l1 if w in s2.token_set])
     
-    l1 = [w for w in l1 if w not in l2]
+    l1 = [w for w in l1 if w not in s2.token_set]
     total_dist = 0.0
     for word in l1:
-        syns = wn.synsets(word)
+        syns = s1.word_synsets[word]
         for word in l2:
-            syns2 = wn.synsets(word)
-            avg_dist = min([0.0] + [s.path_similarity(t) for s in syns for t in syns2]) 
+            syns2 = s2.word_synsets[word]
+            avg_dist = min([0.0] + [wordnet.path_similarity(s, t) for s in syns for t in syns2]) 
             if avg_dist:
                 total_dist += avg_dist
     total_dist /= (len(l1) + 1)
@@ -379,25 +360,22 @@ def synset_similarity(t1, t2):
     
 def synset_overlap_features(t1, t2):
     """Returns counter for all mutual synsets between two sentences."""
-    sent1, sent2 = tree2sent(t1, t2)
-    sent1_synsets = extract_noun_synsets(sent1)
-    sent2_synsets = extract_noun_synsets(sent2)
+    sent1_synsets = analyze(t1).noun_synsets
+    sent2_synsets = set(analyze(t2).noun_synsets)
     overlap_synsets = [str(syn) for syn in sent1_synsets if syn in sent2_synsets]
     return Counter(overlap_synsets)
 
 def synset_exclusive_first_features(t1, t2):
     """Returns counter for all nouns in first sentence with no possible synonyms in second"""
-    sent1, sent2 = tree2sent(t1, t2)
-    sent1_synset_dict = noun_synset_dict(sent1)
-    sent2_synsets = extract_noun_synsets(sent2)
+    sent1_synset_dict = analyze(t1).noun_synset_dict
+    sent2_synsets = analyze(t2).noun_synsets
     firstonly_nouns = [str(noun) for noun in sent1_synset_dict if not len(set(sent1_synset_dict[noun]) & set(sent2_synsets))]
     return Counter(firstonly_nouns)
 
 def synset_exclusive_second_features(t1, t2):
     """Returns counter for all nouns in second sentence with no possible synonyms in first"""
-    sent1, sent2 = tree2sent(t1, t2)
-    sent1_synsets = extract_noun_synsets(sent1)
-    sent2_synset_dict = noun_synset_dict(sent2)
+    sent1_synsets = analyze(t1).noun_synsets
+    sent2_synset_dict = analyze(t2).noun_synset_dict
     secondonly_nouns = [str(noun) for noun in sent2_synset_dict if not len(set(sent2_synset_dict[noun]) & set(sent1_synsets))]
     return Counter(secondonly_nouns)
 
@@ -416,11 +394,13 @@ def subphrase_generator(tree):
 # When a phrase in t2 contains a phrase in t1, count it.
 # TODO: Compare this to a phrase share feature that implements selective
 # deletion of subphrases as a form of the dialogue heuristic.  
+# Shared subphrases are matched on their structural hashes; each shared
+# subphrase counts (occurrences in t1) x (occurrences in t2) pairs.
 def phrase_share_feature(t1, t2):
-    p1, p2 = subphrase_generator(t1), subphrase_generator(t2)
-    shared = [str((v, w)) for v in p1 for w in p2 if v == w]
-    
-    return Counter(shared)
+    h1 = Counter(analyze(t1).subtree_hashes.tolist())
+    h2 = Counter(analyze(t2).subtree_hashes.tolist())
+    return {'phrase_share {0:016x}'.format(h & 0xffffffffffffffff) : count * h2[h]
+            for h, count in h1.iteritems() if h in h2}
 
 def phrase_dialogue_feature(t1, t2):
     p1, p2 = subphrase_generator(t1), subphrase_generator(t2)
@@ -439,19 +419,20 @@ def phrase_common_hyp(t1, t2):
     ''' Checks for lowest common ancestor between two words in a phrase. '''
     global common_hyp_counter
     syns_cache = {}
-    lv_1, lv_2 = leaves(t1), leaves(t2)
+    s1, s2 = analyze(t1), analyze(t2)
+    lv_1, lv_2 = s1.tokens, s2.tokens
     def have_common_hyp(v, w):
         ''' If two word senses have a common hypernym that
             is not a superset / subset relationship, then returns true
             else false. '''
-        if v in lv_2 or w in lv_1:
+        if v in s2.token_set or w in s1.token_set:
             return False
         for syn_v in syns_cache[v]:
             for syn_w in syns_cache[w]:
-                common_hyp = lch(syn_v, syn_w)
+                common_hyp = wordnet.lch(syn_v, syn_w)
                 for h in common_hyp:
                     h_name = h.name().partition('.')[0]
-                    if h_name not in lv_1 and h_name not in lv_2:
+                    if h_name not in s1.token_set and h_name not in s2.token_set:
                         return True
                     else:
                         continue
@@ -462,8 +443,8 @@ def phrase_common_hyp(t1, t2):
     
     # for each word product, if some synset of the words has a common
     # hypernym, then features[phrase : phrase] += 1
-    syn1 = extract_synsets(' '.join(lv_1))
-    syn2 = extract_synsets(' '.join(lv_2))
+    syn1 = s1.synsets
+    syn2 = s2.synsets
 
     ''' Tabulate synsets for each word in each sentence ''' 
     for word in lv_1:
@@ -477,56 +458,46 @@ def phrase_common_hyp(t1, t2):
             if have_common_hyp(v, w):
                  hyp_cache.add((v, w))
            
-    ''' Use a subphrase generator on the sentence.
-        Enforce phrase length > 1 '''
-    p1, p2 = subphrase_generator(t1), subphrase_generator(t2)
-    
-    p1 = [leaves(p) for p in p1 if len(str(p).split(' ')) > 1]
-    p2 = [leaves(p) for p in p2 if len(str(p).split(' ')) > 1]
+    ''' Phrases (length > 1) are integer ids into s.phrases; the
+        inverted index gives the phrases each word occurs in. '''
+    keys1, keys2 = s1.phrase_keys, s2.phrase_keys
 
     features = {}
         
     ''' Count the phrases in which each overlapping word exists.  '''
     for v, w in hyp_cache:
-        common_phrases = [(p, q) for p in p1 for q in p2 if v in p and w in q]
-        for p, q in common_phrases:
-            features["cgom_hyp: {0} {1}".format(p, q)] = 1.0
-            common_hyp_counter += 1
+        phrases_v, phrases_w = s1.word_phrases.get(v, ()), s2.word_phrases.get(w, ())
+        for i in phrases_v:
+            for j in phrases_w:
+                features["cgom_hyp: {0} {1}".format(keys1[i], keys2[j])] = 1.0
+        common_hyp_counter += len(phrases_v) * len(phrases_w)
     
     return features
     
 def general_hypernym(t1, t2):   
     ''' Calculates hypernyms of sentence 1 and sentence 2 using matching POS tags. 
         Also permits self-hypernyms '''
-    s1_leaves, s2_leaves = leaves(t1), leaves(t2)
-    sent1, sent2 = ' '.join(s1_leaves), ' '.join(s2_leaves)
+    s1, s2 = analyze(t1), analyze(t2)
+    sent1, sent2 = s1.text, s2.text
     
-    hsyns = extract_synsets(sent1)
-    syns = extract_synsets(sent2)
-
-    all_hyper_synsets = set(extract_synsets(sent1))
+    hsyns = s1.synsets
+    syns = s2.synsets
 
     # Counts the number of synsets of a word in the sentence with the 
     # same POS tag as parsed 
     s1_len = len(set(s for s in hsyns if s.name().partition('.')[0] in sent1))
     s2_len = len(set(s for s in syns if s.name().partition('.')[0] in sent2))
-                            
-    for h in hsyns:
-        all_hyper_synsets.update(set([i for i in h.closure(lambda s:s.hypernyms())]))
-    overlap = all_hyper_synsets & set(syns)
 
-    feature_string = "hypernyms {0} {1} {2}".format(s1_len, s2_len, len(overlap))
+    # Synsets of sentence 2 among those of sentence 1 and their hypernyms
+    overlap = hypernym_index().overlap(hsyns, syns)
+
+    feature_string = "hypernyms {0} {1} {2}".format(s1_len, s2_len, overlap)
     return Counter({feature_string : 1})
 
 
-_lch_cache = {}
 def lch(syn1, syn2):
-    ''' Utility function to memoize common hypernym relation calls'''
-    global _lch_cache
-    if (syn1, syn2) not in _lch_cache:
-        _lch_cache[(syn1, syn2)] = syn1.lowest_common_hypernyms(syn2)
-        _lch_cache[(syn2, syn1)] = _lch_cache[(syn1, syn2)]
-    return _lch_cache[(syn1, syn2)]
+    ''' Lowest common hypernyms, through the shared WordNet cache. '''
+    return wordnet.lch(syn1, syn2)
 
 
 
@@ -536,22 +507,19 @@ def hypernym_features(t1, t2):
     'A dog is jumping.' entails 'An animal is being active.'
     Returns an indicator feature of form 'contains_hypernyms: True/False'
     """
-    sent1 = ' '.join(leaves(t1))
-    sent2 = ' '.join(leaves(t2))
-    s1_nouns, s1_syns = extract_nouns_and_synsets(sent1)
+    s1, s2 = analyze(t1), analyze(t2)
+    s1_nouns, s1_syns = s1.nouns, s1.noun_synsets
 
     
-    s2_nouns, s2_syns  = extract_nouns_and_synsets(sent2)
-    all_hyper_synsets = set(s1_syns) #Stores the hypernym synsets of the nouns in the first sentence
+    s2_nouns, s2_syns  = s2.nouns, s2.noun_synsets
     s1_len, s2_len = len(s1_nouns), len(s2_nouns)
 
-    for syn in s1_syns:
-        all_hyper_synsets.update(set([i for i in syn.closure(lambda s:s.hypernyms())]))
-    synset_overlap = all_hyper_synsets & set(s2_syns) # Stores intersection of sent2 synsets and hypernyms of sent1
+    # Number of sent2 synsets among the synsets of sent1 nouns and their hypernyms
+    synset_overlap = hypernym_index().overlap(s1_syns, s2_syns)
     
     # Discretize into smaller buckets based on the number of nouns in each sentence,
     # and the size of the synset overlap.
-    feature_string = 'hypernyms {0} {1} {2}'.format(s1_len, s2_len, len(synset_overlap))
+    feature_string = 'hypernyms {0} {1} {2}'.format(s1_len, s2_len, synset_overlap)
 
     return Counter({feature_string : 1})
 
@@ -560,26 +528,25 @@ def antonym_features(t1, t2):
     """Use antonyms between sentences to recognize contradiction patterns. TODO: Extract antonyms from nouns and other syntactic families as well!"""
     feature = {}
     
-    sent1 = ' '.join(leaves(t1))
-    sent2 = ' '.join(leaves(t2))
-    sent2_lemmas = extract_lemmas(sent2)
-    sent1_antonyms = extract_adj_antonyms(sent1)
+    s1, s2 = analyze(t1), analyze(t2)
+    sent2_lemmas = set(s2.lemmas)
+    sent1_antonyms = s1.antonyms
     antonyms = [str(lem) for lem in sent1_antonyms if lem in sent2_lemmas]
     num_antonyms = len(antonyms)
 
-    overlap_size = sum (1 for w in leaves(t1) if w in leaves(t2))
-    sent_length = len(leaves(t1) + leaves(t2))
+    overlap_size = sum (1 for w in s1.tokens if w in s2.token_set)
+    sent_length = len(s1.tokens) + len(s2.tokens)
     ratio = overlap_size * 1.0 / sent_length
     feature['antonym with similarity {0}'.format(int(ratio / 0.2))] = num_antonyms
     return feature
     
 def word_cross_product_features(t1, t2):
-    return Counter([(w1, w2) for w1, w2 in itertools.product(leaves(t1), leaves(t2))])
+    return pair_counts(analyze(t1).tokens, analyze(t2).tokens)
 
 
 def word_cross_product_nv(t1, t2):
-    nv1 = [w[0] for w in pos_tag(leaves(t1)) if penn2wn(w[1]) in 'nv']
-    nv2 = [w[0] for w in pos_tag(leaves(t2)) if penn2wn(w[1]) in 'nv']
+    nv1 = [w[0] for w in analyze(t1).tagged if penn2wn(w[1]) in 'nv']
+    nv2 = [w[0] for w in analyze(t2).tagged if penn2wn(w[1]) in 'nv']
 
 def frame_overlap_features(t1, t2, sf1, sf2):
     frame_names1 = [f1.name for f1 in sf1]
@@ -594,10 +561,10 @@ def frame_overlap_features(t1, t2, sf1, sf2):
 def frame_cross_product_features(t1, t2, sf1, sf2):
     frame_names1 = [f1.name for f1 in sf1]
     frame_names2 = [f2.name for f2 in sf2]
-    return Counter([(f1, f2) for f1, f2 in itertools.product(frame_names1, frame_names2)])
+    return pair_counts(frame_names1, frame_names2)
 
 def super_overlap(sf1, sf2):
-    return [(f1, f2) for f1 in sf1 for f2 in sf2 if is_super_frame(f1, f2)]
+    return [(sf1[i], sf2[j]) for i, j in super_frame_pairs(sf1, sf2)]
 
 def frame_entailment_features(t1, t2, sf1, sf2):
     super_overlap_strings = ['entailed_frame_' + f1.name for (f1, f2) in super_overlap(sf1, sf2)]
@@ -627,73 +594,18 @@ def frame_similarity_features(t1, t2, sf1, sf2):
 
 def negation_features(t1, t2):
     feat = {}
-    s1, s2 = leaves(t1), leaves(t2)
+    s1, s2 = analyze(t1).token_set, analyze(t2).token_set
     for word in ['no', 'not', 'none', "n't", 'nobody']:
         if (word in s1 and word not in s2) or (word in s2 and word not in s1):
             feat['{0}_negation'.format(word)] = 1.0
 
     return feat
 
-grammar = """ \
-            NN-PHRASE: {<DT.*> <NN> <RB>}
-                      { <JJ> <NN>}
-                      {<NN> <IN> <NN>}
-                      {<RB> <JJ> <NN>}
-                      { <NNS> <RB>}
-                      { <JJ> <NNS>}
-                      {<NNS> <IN> <NNS>}
-                      {<RB> <JJ> <NNS>}
-                      { <NNP> <RB>}
-                      { <JJ> <NNP>}
-                      {<NNP> <IN> <NNP>}
-                      {<RB> <JJ> <NNP>}
-                      { <NNPS> <RB>}
-                      {<DT.*> <JJ> <NNPS>}
-                      {<NNPS> <IN> <NNP>}
-                      {<RB> <JJ> <NNPS>}
-                      {<NN> <VBZ> <VBG>}
-                      {<NNS> <VBZ> <VBG>}
-                      {<NN> <VBP> <VBG>}
-                      {<NNS> <VBP> <VBG>}
-
-            VB-PHRASE : {<RB> <VB>}
-                        {<RB> <VBD>}
-                        {<RB> <VBG>}
-                        {<RB> <VBN>}
-                        {<RB> <VBP>}
-                        {<RB> <VBZ>}
-                        {<RBR> <VB>}
-                        {<RBR> <VBD>}
-                        {<RBR> <VBG>}
-                        {<RBR> <VBN>}
-                        {<RBR> <VBP>}
-                        {<RBR> <VBZ>}
-                        {<RBS> <VB>}
-                        {<RBS> <VBD>}
-                        {<RBS> <VBG>}
-                        {<RBS> <VBN>}
-                        {<RBS> <VBP>}
-                        {<RBS> <VBZ>}
-                        {<VBG> <IN> <DT> <NN>}
-                        {<VBG> <IN> <DT> <NNS>}
-
-          """
-cp = nltk.RegexpParser(grammar)
-
 def get_noun_phrase_labeled(t1,t2):
     """Gets noun phrases for given trees as lists with
-    labeled POS tags."""
-    sent1 = leaves(t1)
-    sent2 = leaves(t2)
-
-    tree1 = cp.parse(nltk.pos_tag(sent1))
-    tree2 = cp.parse(nltk.pos_tag(sent2))
-
-    #List of noun phrases with tokens and POS tags
-    np1 = [subtree1.leaves() for subtree1 in tree1.subtrees() if subtree1.label() == 'NN-PHRASE']
-    np2 = [subtree2.leaves() for subtree2 in tree2.subtrees() if subtree2.label() == 'NN-PHRASE']
-
-    return np1, np2
+    labeled POS tags.  The chunks are computed once per sentence
+    (see Sentence.noun_phrases)."""
+    return analyze(t1).noun_phrases, analyze(t2).noun_phrases
 
 def get_noun_phrase_words(nps_labeled):
     """Gets the words of a noun phrase."""
@@ -709,12 +621,10 @@ def get_noun_phrase_mapping(np1, np2):
 
     return np1_token_mapping, np2_token_mapping
 
-npm_counter = 0
 def noun_phrase_modifier_features(t1, t2):
     """Extracts noun phrases within sentences and identifies
     whether a noun phrase in second sentence is subsumed by first."""
     feat = []
-    global npm_counter
     np1, np2 = get_noun_phrase_labeled(t1, t2)
     # TODO: get compositionality statistics, and see if they are sparse or not.
     np1_token_mapping, np2_token_mapping = get_noun_phrase_mapping(np1, np2)
@@ -728,15 +638,14 @@ def noun_phrase_modifier_features(t1, t2):
                 np2_pos = [tok[1] for tok in sent2_entities]
                 feature_key = ",".join(np1_pos) + ":" + ",".join(np2_pos)
                 feat += [feature_key]
-                npm_counter += 1
-                
-    print npm_counter
+
     return Counter(feat)
 
 def get_noun_phrase_vector(noun_phrase):
     """Generate an aggregate distributed word vector
     for a given noun phrase."""
-    all_word_vecs = [glvvec(w) for w in noun_phrase if w in GLOVE_VOCAB] #How often are the words not in glove vocab?
+    init_glv()
+    all_word_vecs = [glvvec(w) for w in noun_phrase if w in GLOVE] #How often are the words not in glove vocab?
     return np.sum(all_word_vecs, axis=0)
 
 def noun_phrase_word_vec_features(t1, t2):
@@ -797,24 +706,151 @@ features_mapping = {'word_cross_product': word_cross_product_features,
     'glv_overlap': lambda t1, t2: glv_window_overlap(t1, t2, n=3)
              }
     
-def featurizer(reader=sick_train_reader, features_funcs=None):
+# Templates returning DenseFeatures, with their fixed column names
+dense_templates = {'glv_diff' : _glv_dim_keys}
+
+def dense_names(features_funcs):
+    """Column names of the dense block of features_funcs, in template order."""
+    return [name for feat in features_funcs if feat in dense_templates for name in dense_templates[feat]]
+
+_glove_features = set(['glv_diff', 'glv_cos', 'glv_overlap', 'noun_phrase_word_vec'])
+_hypernym_features = set(['hypernyms', 'new_hyp'])
+_wordnet_features = set(['synset_overlap', 'synset_similarity', 'hypernyms', 'new_hyp', 'common_hypernym',
+                         'antonyms', 'first_not_second', 'second_not_first'])
+
+_template_profile = None
+
+def profile_templates(profile):
+    """Records the time, calls and emitted keys of every template call
+    into profile (a TemplateProfile), or stops recording if it is None.
+    Returns the profile installed before.  When not recording, a
+    template call costs a single extra comparison."""
+    global _template_profile
+    previous, _template_profile = _template_profile, profile
+    return previous
+
+def template_features(features_funcs, t1, t2, sf1, sf2):
+    """Extracts the features of a single sentence pair, one dict per template."""
+    t1, t2 = analyze(t1), analyze(t2)
+    profile = _template_profile
+    dicts = []
+    for feat in features_funcs:
+        if profile is not None:
+            start = _timer()
+        if feat.startswith('frame'):
+            d = features_mapping[feat](t1, t2, sf1, sf2)
+        else:
+            d = features_mapping[feat](t1, t2)
+        if profile is not None:
+            profile.record(feat, _timer() - start, len(d))
+        dicts.append(d)
+    return dicts
+
+def featurize_pair(features_funcs, t1, t2, sf1, sf2):
+    """Extracts the features of a single sentence pair into one FeatureRow
+    (see features.crossproduct); its as_dict() is the merged feature dict."""
+    row = FeatureRow() #Stores all features extracted using feature functions
+    for d in template_features(features_funcs, t1, t2, sf1, sf2):
+        row.add(d)
+    return row
+
+def _featurize_chunk(args):
+    """Pool worker: featurizes a chunk of reader examples, in order.
+    Caches (sentence analysis, GloVe, WordNet) stay warm across the
+    chunks a worker process receives; the WordNet entries and lookups
+    of the chunk are sent back with its results."""
+    global _template_profile
+    features_funcs, chunk, per_template, profiled = args
+    # The worker profiles each chunk on its own; the parent merges them.
+    _template_profile = TemplateProfile() if profiled else None
+    wordnet.track()
+    extract = template_features if per_template else featurize_pair
+    return ([(extract(features_funcs, t1, t2, sf1, sf2), label)
+             for label, t1, t2, sf1, sf2 in chunk], _template_profile, wordnet.changes())
+
+def _chunks(examples, size):
+    chunk = []
+    for example in examples:
+        chunk.append(example)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _warm_caches(features_funcs):
+    """Loads the shared resources once in the parent, so forked workers inherit them."""
+    if _wordnet_features.intersection(features_funcs):
+        wn.synsets('entity')
+    if _glove_features.intersection(features_funcs):
+        init_glv()
+    if _hypernym_features.intersection(features_funcs):
+        hypernym_index()
+
+def iter_featurize(reader=sick_train_reader, features_funcs=None, n_jobs=1, chunk_size=200, per_template=False):
+    """Lazily yields (FeatureRow, label) for each pair of reader, in order.
+    With per_template set, a list of the template outputs (feature dicts,
+    PairCounts for the cross-product templates, DenseFeatures for the
+    dense ones) is yielded in place of the row.
+
+    With n_jobs other than 1 (-1 for all cores), the reader output is
+    sharded in chunks of chunk_size pairs across a process pool; results
+    still come back in reader order.  Inside a daemonic process (e.g. an
+    ablation worker) featurization stays serial.  Template profiles
+    (see profile_templates) and the WordNet cache entries and counters
+    of the pool processes are merged in.  """
+    extract = template_features if per_template else featurize_pair
+    if n_jobs == 1 or current_process().daemon:
+        for label, t1, t2, sf1, sf2 in reader():
+            yield extract(features_funcs, t1, t2, sf1, sf2), label
+        return
+
+    # The first pair is featurized here, so the split's stored tags (tagged on
+    # first use, see util.corpus) are loaded before the workers are forked.
+    examples = reader()
+    for label, t1, t2, sf1, sf2 in itertools.islice(examples, 1):
+        yield extract(features_funcs, t1, t2, sf1, sf2), label
+    _warm_caches(features_funcs)
+    pool = Pool(cpu_count() if n_jobs < 0 else n_jobs)
+    finished = False
+    try:
+        profiled = _template_profile is not None
+        chunks = ((features_funcs, chunk, per_template, profiled) for chunk in _chunks(examples, chunk_size))
+        for results, profile, wordnet_changes in pool.imap(_featurize_chunk, chunks):
+            if profile is not None and _template_profile is not None:
+                _template_profile.merge(profile)
+            wordnet.merge(wordnet_changes)
+            for result in results:
+                yield result
+        finished = True
+    finally:
+        # After an error, or when the consumer stops early, the queued
+        # chunks are dropped rather than featurized.
+        if finished:
+            pool.close()
+        else:
+            pool.terminate()
+        pool.join()
+
+def featurizer(reader=sick_train_reader, features_funcs=None, n_jobs=1, chunk_size=200, profile=None):
     """Map the data in reader to a list of features according to feature_function,
     and create the gold label vector.
 
-    Valid feature_funcs return a dict of string : int key-value pairs.  """
+    Valid feature_funcs return a dict of string : int key-value pairs
+    (or a PairCounts, or a DenseFeatures for the templates listed in
+    dense_templates); the returned features are merged dicts.
+    Each tree is replaced by its shared Sentence analysis (see
+    features.sentence) before being handed to the templates.  See
+    iter_featurize for n_jobs and chunk_size.  Given a TemplateProfile
+    as profile, the template calls of this run are recorded in it.  """
     feats = []
     labels = []
-    split_index = None
-
-    for label, t1, t2, sf1, sf2 in reader():
-        feat_dict = {} #Stores all features extracted using feature functions
-        for feat in features_funcs:
-            if feat.startswith('frame'):
-                d = features_mapping[feat](t1, t2, sf1, sf2)
-            else:
-                d = features_mapping[feat](t1, t2)
-            feat_dict.update(d)
-
-        feats.append(feat_dict)
-        labels.append(label)
+    previous = profile_templates(profile) if profile is not None else None
+    try:
+        for row, label in iter_featurize(reader, features_funcs, n_jobs, chunk_size):
+            feats.append(row.as_dict())
+            labels.append(label)
+    finally:
+        if profile is not None:
+            profile_templates(previous)
     return (feats, labels)
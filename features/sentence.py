@@ -0,0 +1,216 @@
+__author__ = 'chrisbillovits/mihaileric/chrisguthrie'
+
+''' Per-sentence analysis shared by every feature template.
+
+    A Sentence is the parse tree itself (a tuple subclass, so leaves(),
+    str() and subphrase_generator() keep working on it) that additionally
+    computes tokens, POS tags, chunks, lemmas, synsets, depths and subtree
+    hashes on first access and keeps them.  analyze() deduplicates sentences across
+    the whole corpus: SICK reuses the same sentence in many pairs, and
+    every template of every pair then reads the same analysis.  The
+    cache keeps the most recently used analyses only (50000 sentences by
+    default), so streaming a large corpus does not hold every sentence.  '''
+
+import os
+import sys
+from collections import OrderedDict
+
+"""Add root directory path"""
+root_dir = os.path.dirname(os.path.dirname(__file__))
+sys.path.append(root_dir)
+
+from nltk import pos_tag
+from nltk.corpus import wordnet as wn
+from nltk.stem import WordNetLemmatizer
+from util.tree import ArrayTree
+from util.wordnet_cache import wordnet
+from util.corpus import stored_tags
+from chunker import phrase_chunker
+
+lemmatizer = WordNetLemmatizer()
+
+def penn2wn(tag):
+    """ Given a Penn Treebank tag, returns the appropriate
+        WordNet tag, if possible.  Otherwise returns ''. """
+
+    if tag[0] in 'JVNR':
+        ind = 'JVNR'.index(tag[0]) # Starts with (AD)J, V(ERB), N(OUN), (ADVE)R(B)
+        return 'avnr'[ind]
+    return ''
+
+def tag_tokens(tokens):
+    ''' (word, Penn tag) pairs, from the tagged corpus when it has the sentence. '''
+    tagged = stored_tags(tokens)
+    return tagged if tagged is not None else pos_tag(tokens)
+
+def _cached(func):
+    ''' Turns an analysis method into an attribute computed once per sentence. '''
+    name = func.__name__
+    def getter(self):
+        try:
+            return self.__dict__[name]
+        except KeyError:
+            value = self.__dict__[name] = func(self)
+            return value
+    return property(getter, doc = func.__doc__)
+
+class Sentence(tuple):
+    ''' A parse tree together with its lazily computed analysis. '''
+
+    def __reduce__(self):
+        # Only the tree travels between processes; the analysis is redone there.
+        return (Sentence, (tuple(self),))
+
+    @_cached
+    def tree(self):
+        ''' Array representation of the parse (see util.tree). '''
+        return ArrayTree(self)
+
+    @_cached
+    def tokens(self):
+        ''' Words (terminal nodes) of the tree, in order. '''
+        return self.tree.tokens
+
+    @_cached
+    def token_set(self):
+        return frozenset(self.tokens)
+
+    @_cached
+    def text(self):
+        return ' '.join(self.tokens)
+
+    @_cached
+    def tagged(self):
+        ''' (word, Penn tag) pairs for the tokens. '''
+        return tag_tokens(self.tokens)
+
+    @_cached
+    def chunks(self):
+        ''' NN-PHRASE / VB-PHRASE chunk spans of the tagged tokens, by label
+            (see features.chunker). '''
+        return phrase_chunker.chunk([tag for word, tag in self.tagged])
+
+    @_cached
+    def noun_phrases(self):
+        ''' (word, tag) pairs of each NN-PHRASE chunk, in order. '''
+        tagged = self.tagged
+        spans = self.chunks.get('NN-PHRASE')
+        return [tagged[start:end] for start, end in spans.tolist()] if spans is not None else []
+
+    @_cached
+    def nouns(self):
+        return [word for word, tag in self.tagged if tag == 'NN' or tag == 'NNS']
+
+    @_cached
+    def noun_lemmas(self):
+        return [lemmatizer.lemmatize(noun) for noun in self.nouns]
+
+    @_cached
+    def noun_synset_dict(self):
+        return {noun : wordnet.synsets(noun, pos=wn.NOUN) for noun in self.nouns}
+
+    @_cached
+    def noun_synsets(self):
+        ''' Noun synsets of every noun, in order (with repetitions). '''
+        synsets = []
+        for noun in self.nouns:
+            synsets.extend(self.noun_synset_dict[noun])
+        return synsets
+
+    @_cached
+    def synsets(self):
+        ''' Synsets of every token, restricted to its tagged part of speech. '''
+        synsets = []
+        for word, tag in self.tagged:
+            synsets.extend(wordnet.synsets(word, pos=penn2wn(tag)))
+        return synsets
+
+    @_cached
+    def word_synsets(self):
+        ''' All synsets of each token, regardless of part of speech. '''
+        return {word : wordnet.synsets(word) for word in self.token_set}
+
+    @_cached
+    def lemmas(self):
+        lemmas = []
+        for word in self.tokens:
+            lemmas.extend(wordnet.lemmas(word))
+        return lemmas
+
+    @_cached
+    def antonyms(self):
+        antonyms = []
+        for word in self.tokens:
+            antonyms.extend(wordnet.antonyms(word))
+        return antonyms
+
+    @_cached
+    def depths(self):
+        ''' Depth of each token in the tree; children of the root are at depth 1. '''
+        return self.tree.leaf_depths.tolist()
+
+    @_cached
+    def depth(self):
+        ''' Maximum bracket nesting of the tree. '''
+        return self.tree.max_depth
+
+    @_cached
+    def word_depth(self):
+        ''' Depth of the first occurrence of each word. '''
+        first = {}
+        for word, depth in zip(self.tokens, self.depths):
+            first.setdefault(word, depth)
+        return first
+
+    @_cached
+    def phrases(self):
+        ''' Words of every phrase of more than one word, in preorder. '''
+        return [self.tree.words(p) for p in self.tree.phrases()]
+
+    @_cached
+    def phrase_keys(self):
+        ''' str() of the word list of each phrase, as used in feature names. '''
+        return [str(words) for words in self.phrases]
+
+    @_cached
+    def word_phrases(self):
+        ''' Inverted index from each word to the ids (positions in phrases)
+            of the phrases containing it. '''
+        index = {}
+        for i, words in enumerate(self.phrases):
+            for word in set(words):
+                index.setdefault(word, []).append(i)
+        return index
+
+    @_cached
+    def subtree_hashes(self):
+        ''' Structural hash of each subphrase (subtree or leaf), in preorder. '''
+        return self.tree.structural_hashes()
+
+_sentences = OrderedDict()
+_analysis_cache_size = 50000
+
+def analyze(t):
+    ''' Returns the shared Sentence for tree t, creating it on first sight.
+        The most recently used analyses are kept, up to the cache size. '''
+    if isinstance(t, Sentence):
+        return t
+    try:
+        sentence = _sentences.pop(t)
+    except KeyError:
+        sentence = Sentence(t)
+        while len(_sentences) >= _analysis_cache_size:
+            _sentences.popitem(last = False)
+    _sentences[t] = sentence
+    return sentence
+
+def resize_analysis_cache(size):
+    ''' Keeps at most size sentence analyses, dropping the least recently used. '''
+    global _analysis_cache_size
+    _analysis_cache_size = size
+    while len(_sentences) > size:
+        _sentences.popitem(last = False)
+
+def clear_analysis_cache():
+    ''' Drops every cached sentence analysis. '''
+    _sentences.clear()
@@ -0,0 +1,325 @@
+__author__ = 'chrisbillovits'
+
+''' Per-template feature store.
+
+    Every template's output on a split is saved as its own columnar
+    artifact (a CSR matrix plus its column names) under output/feature_store.
+    An artifact is keyed by a hash of the split's data files, the template
+    name and the source code of the template and of the repository code it
+    calls, so it is recomputed exactly when one of these changes.  Any
+    feature configuration is then assembled from the stored pieces, and
+    configurations sharing templates share their featurization cost:
+    adding a template to a configuration only computes that template,
+    and removing one only leaves it out of the assembly.  The merged
+    columns of a configuration are saved as well, under the manifest of
+    the artifacts they came from, so an unchanged configuration is
+    assembled again from a single file.  '''
+
+import os
+import sys
+
+"""Add root directory path"""
+root_dir = os.path.dirname(os.path.dirname(__file__))
+sys.path.append(root_dir)
+
+import dis
+import hashlib
+import inspect
+import cPickle as pickle
+import numpy as np
+import scipy.sparse as sp
+
+from features import features_mapping, dense_templates, iter_featurize
+from vectorize import FeatureVocabulary, RowBuilder
+from dense import FeatureMatrix
+from util.utils import data_files, reader_split
+from util.colors import color, prettyPrint
+
+_repo_dir = os.path.abspath(root_dir)
+_file_hashes = {}
+_fingerprints = {}
+_module_states = {}
+_store_global = dis.opmap['STORE_GLOBAL']
+
+def file_hash(filename):
+    ''' md5 of a file's contents, memoized on its size and mtime. '''
+    if not os.path.isfile(filename):
+        return 'missing'
+    stat = os.stat(filename)
+    key = (filename, stat.st_size, stat.st_mtime)
+    if key not in _file_hashes:
+        md5 = hashlib.md5()
+        with open(filename, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), ''):
+                md5.update(block)
+        _file_hashes[key] = md5.hexdigest()
+    return _file_hashes[key]
+
+def data_hash(reader):
+    ''' Hash of the data files read by reader, one of the sick_*_reader functions. '''
+    split = reader_split(reader)
+    if split is None:
+        raise ValueError('The feature store only holds the SICK splits, not the output of {0!r}'.format(reader))
+    return hashlib.md5(' '.join(file_hash(f) for f in data_files[split])).hexdigest()
+
+def _is_repo_code(obj):
+    try:
+        return os.path.abspath(inspect.getsourcefile(obj)).startswith(_repo_dir)
+    except TypeError:
+        return False
+
+def _referenced_names(code):
+    names = set(code.co_names)
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _referenced_names(const)
+    return names
+
+def _plain_repr(value):
+    ''' repr of a constant-like value (strings, numbers and lists or
+        tuples of them), or None for anything else. '''
+    if value is None or isinstance(value, (basestring, bool, int, long, float)):
+        return repr(value)
+    if isinstance(value, (list, tuple)):
+        items = [_plain_repr(v) for v in value]
+        if None not in items:
+            return '({0})'.format(', '.join(items))
+    return None
+
+def _stored_globals(code):
+    ''' Global names a code object (or code nested in it) assigns to. '''
+    names = set()
+    ops = map(ord, code.co_code)
+    i = 0
+    while i < len(ops):
+        if ops[i] == _store_global:
+            names.add(code.co_names[ops[i + 1] | ops[i + 2] << 8])
+        i += 3 if ops[i] >= dis.HAVE_ARGUMENT else 1
+    for const in code.co_consts:
+        if inspect.iscode(const):
+            names |= _stored_globals(const)
+    return names
+
+def _module_state(module_name):
+    ''' Global names that some function or method of the module assigns. '''
+    if module_name not in _module_states:
+        names = set()
+        for obj in vars(sys.modules[module_name]).values():
+            members = vars(obj).values() if inspect.isclass(obj) else [obj]
+            for member in members:
+                member = member.fget if isinstance(member, property) else member
+                if inspect.isfunction(member) and member.__module__ == module_name:
+                    names |= _stored_globals(member.__code__)
+        _module_states[module_name] = names
+    return _module_states[module_name]
+
+def template_fingerprint(template):
+    ''' Hash of the template's source and of all repository functions and
+        classes it references, followed transitively.  Functions wrapped
+        in closures (e.g. the cached Sentence properties) are followed,
+        constants are hashed by value, and a module-level instance of a
+        repository class (e.g. phrase_chunker) brings in the source of its
+        class's module, where it is built.  Globals that a function of
+        their module assigns (counters, settings, lazily loaded resources)
+        are runtime state and are left out, so the key does not change
+        during a run. '''
+    if template in _fingerprints:
+        return _fingerprints[template]
+    sources = []
+    constants = {}
+    seen = set()
+    def visit_value(value, key = None):
+        if inspect.isfunction(value) or inspect.isclass(value):
+            visit(value)
+        elif key is not None and key[1] in _module_state(key[0]):
+            # Runtime state (counters, settings, lazily loaded resources
+            # such as GLOVE): hashing it would change the key mid-run.
+            return
+        elif _plain_repr(value) is not None:
+            constants[key or len(constants)] = _plain_repr(value)
+        elif not inspect.ismodule(value) and _is_repo_code(type(value)):
+            visit(type(value))
+            visit(sys.modules[type(value).__module__])
+    def visit(obj):
+        if id(obj) in seen or not _is_repo_code(obj):
+            return
+        seen.add(id(obj))
+        sources.append(inspect.getsource(obj))
+        if inspect.isclass(obj):
+            for member in vars(obj).values():
+                visit(member.fget if isinstance(member, property) else member)
+        elif inspect.isfunction(obj):
+            for cell in obj.__closure__ or ():
+                visit_value(cell.cell_contents)
+            for name in sorted(_referenced_names(obj.__code__)):
+                if name in obj.__globals__:
+                    visit_value(obj.__globals__[name], (obj.__module__, name))
+    visit(features_mapping[template])
+    sources.extend(constants[key] for key in sorted(constants))
+    _fingerprints[template] = hashlib.md5(template + '\n'.join(sources)).hexdigest()
+    return _fingerprints[template]
+
+def publish(filename, write):
+    ''' Creates filename by calling write on a file object of a temporary
+        name private to the process, then renaming it into place.  Processes
+        featurizing the same template at once (e.g. ablation workers) may
+        each publish it, but a reader never sees a partly written file. '''
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        try:
+            os.makedirs(directory)
+        except OSError:
+            if not os.path.isdir(directory):
+                raise
+    temporary = '{0}.{1}.tmp'.format(filename, os.getpid())
+    try:
+        with open(temporary, 'wb') as f:
+            write(f)
+        os.rename(temporary, filename)
+    finally:
+        if os.path.isfile(temporary):
+            os.remove(temporary)
+
+class FeatureStore(object):
+    ''' Columnar per-template, per-split feature artifacts. '''
+
+    def __init__(self, directory = 'output/feature_store'):
+        self.directory = directory
+
+    def _path(self, template, reader):
+        key = hashlib.md5(data_hash(reader) + template + template_fingerprint(template)).hexdigest()
+        return os.path.join(self.directory, '{0}.{1}.{2}'.format(template, reader_split(reader), key[:12]))
+
+    def _labels_path(self, reader):
+        return os.path.join(self.directory, 'labels.{0}.{1}'.format(reader_split(reader), data_hash(reader)[:12]))
+
+    def load(self, template, reader):
+        ''' Returns the stored (matrix, column names) of template, or None. '''
+        path = self._path(template, reader)
+        if not os.path.isfile(path + '.npz') or not os.path.isfile(path + '.names'):
+            return None
+        arrays = np.load(path + '.npz')
+        X = sp.csr_matrix((arrays['data'], arrays['indices'], arrays['indptr']), shape = tuple(arrays['shape']))
+        with open(path + '.names', 'rb') as f:
+            names = pickle.load(f)
+        return X, names
+
+    def save(self, template, reader, X, names):
+        path = self._path(template, reader)
+        publish(path + '.names', lambda f: pickle.dump(names, f, pickle.HIGHEST_PROTOCOL))
+        publish(path + '.npz', lambda f: np.savez(f, data = X.data, indices = X.indices, indptr = X.indptr,
+                                                  shape = np.array(X.shape)))
+
+    def labels(self, reader):
+        path = self._labels_path(reader)
+        if not os.path.isfile(path):
+            return None
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+
+    def compute(self, templates, reader, n_jobs = 1):
+        ''' Featurizes reader with the given templates in one pass and
+            stores each template's output separately. '''
+        prettyPrint("Featurizing {0} for templates {1} ...".format(reader_split(reader), templates), color.CYAN)
+        vocabularies = [FeatureVocabulary() for template in templates]
+        builders = [RowBuilder(vocabulary) for vocabulary in vocabularies]
+        labels = []
+        for dicts, label in iter_featurize(reader, templates, n_jobs, per_template = True):
+            for builder, d in zip(builders, dicts):
+                builder.add(d)
+            labels.append(label)
+        for template, builder, vocabulary in zip(templates, builders, vocabularies):
+            self.save(template, reader, builder.tomatrix(), vocabulary.feature_names)
+        publish(self._labels_path(reader), lambda f: pickle.dump(labels, f, pickle.HIGHEST_PROTOCOL))
+
+    def columns(self, templates, reader, n_jobs = 1):
+        ''' Returns ([(matrix, column names) per template], labels),
+            computing whatever is not stored yet. '''
+        columns = [self.load(t, reader) for t in templates]
+        labels = self.labels(reader)
+        missing = [t for t, c in zip(templates, columns) if c is None or labels is None]
+        if missing:
+            self.compute(missing, reader, n_jobs)
+            columns = [c if t not in missing else self.load(t, reader) for t, c in zip(templates, columns)]
+            labels = self.labels(reader)
+        return columns, labels
+
+    def manifest(self, templates, reader):
+        ''' (template, artifact name) of each template: what a vector set
+            assembled from the store contains, and the key its merged
+            columns are cached under (see merge). '''
+        return [(t, os.path.basename(self._path(t, reader))) for t in templates]
+
+    def _set_path(self, manifest, reader):
+        key = hashlib.md5(repr(manifest)).hexdigest()
+        return os.path.join(self.directory, 'set.{0}.{1}'.format(reader_split(reader), key[:12]))
+
+    def merge(self, templates, reader, n_jobs = 1):
+        ''' Returns (rows, name ids, values, names, dense block or None,
+            labels): the stored matrices of the given templates merged
+            column-wise in name space, computing the templates not stored
+            yet.  When two templates emit the same name for a row, the
+            later one wins; dense templates (see features/dense.py) fill
+            the dense block.  The result is saved with the manifest of the
+            templates, and reused as long as the manifest is unchanged. '''
+        manifest = self.manifest(templates, reader)
+        path = self._set_path(manifest, reader)
+        if os.path.isfile(path + '.npz') and os.path.isfile(path + '.names'):
+            with open(path + '.names', 'rb') as f:
+                saved_manifest, names, labels = pickle.load(f)
+            if saved_manifest == manifest:
+                arrays = np.load(path + '.npz')
+                dense = arrays['dense'] if 'dense' in arrays.files else None
+                return arrays['rows'], arrays['ids'], arrays['data'], names, dense, labels
+
+        columns, labels = self.columns(templates, reader, n_jobs)
+        n_rows = len(labels)
+        name_ids, rows, ids, data, dense = {}, [], [], [], []
+        for template, (X, names) in zip(templates, columns):
+            X = X.tocoo()
+            if template in dense_templates:
+                position = {name : k for k, name in enumerate(dense_templates[template])}
+                block = np.zeros((n_rows, len(position)), dtype = np.float32)
+                block[X.row, np.array([position[name] for name in names], dtype = np.int64)[X.col]] = X.data
+                dense.append(block)
+                continue
+            local = np.array([name_ids.setdefault(name, len(name_ids)) for name in names], dtype = np.int64)
+            rows.append(X.row.astype(np.int64))
+            ids.append(local[X.col])
+            data.append(X.data.astype(np.float64))
+        rows = np.concatenate(rows) if rows else np.zeros(0, dtype = np.int64)
+        ids = np.concatenate(ids) if ids else np.zeros(0, dtype = np.int64)
+        data = np.concatenate(data) if data else np.zeros(0)
+        dense = np.hstack(dense) if dense else None
+
+        # Later templates override earlier ones: keep the last entry of each (row, name).
+        keys = rows * max(len(name_ids), 1) + ids
+        order = np.argsort(keys, kind = 'mergesort')
+        last = np.ones(len(order), dtype = bool)
+        last[:-1] = keys[order][1:] != keys[order][:-1]
+        rows, ids, data = rows[order][last], ids[order][last], data[order][last]
+
+        names = [None] * len(name_ids)
+        for name, i in name_ids.iteritems():
+            names[i] = name
+
+        arrays = {'rows' : rows, 'ids' : ids, 'data' : data}
+        if dense is not None:
+            arrays['dense'] = dense
+        publish(path + '.npz', lambda f: np.savez(f, **arrays))
+        publish(path + '.names', lambda f: pickle.dump((manifest, names, labels), f, pickle.HIGHEST_PROTOCOL))
+        return rows, ids, data, names, dense, labels
+
+    def assemble(self, templates, reader, vocabulary, n_jobs = 1):
+        ''' Returns (matrix, labels) of the given templates against
+            vocabulary, as RowBuilder would build them from featurizer rows,
+            from their merged columns (see merge).  With dense templates
+            the matrix is a FeatureMatrix. '''
+        rows, ids, data, names, dense, labels = self.merge(templates, reader, n_jobs)
+        cols = np.array([-1 if col is None else col for col in map(vocabulary.column, names)], dtype = np.int64)
+        keep = cols[ids] >= 0 if len(ids) else np.zeros(0, dtype = bool)
+        # A HashingVocabulary may map several names to a column; csr_matrix adds them up.
+        X = sp.csr_matrix((data[keep], (rows[keep], cols[ids[keep]])), shape = (len(labels), len(vocabulary)))
+        if dense is not None:
+            X = FeatureMatrix(X, dense)
+        return X, labels
@@ -0,0 +1,104 @@
+__author__ = 'chrisbillovits'
+
+''' Per-template featurization profile.
+
+    While a TemplateProfile is installed (see features.profile_templates),
+    every template call records its wall-clock time and the number of
+    keys it emitted.  Latencies go into a fixed log-scale histogram per
+    template (20 bins per decade, from 0.1 microseconds), so memory does
+    not grow with the data and p50 / p99 are exact to within the 12% bin
+    width.  Profiles of worker processes are merged into the parent's.  '''
+
+import os
+import math
+import json
+
+_bins_per_decade = 20
+_min_exponent = -7 # 0.1 microseconds
+_n_bins = 9 * _bins_per_decade # up to 100 seconds
+
+class TemplateStats(object):
+    ''' Calls, total seconds, emitted keys and latency histogram of one template. '''
+
+    def __init__(self):
+        self.calls = 0
+        self.seconds = 0.0
+        self.keys = 0
+        self.histogram = [0] * _n_bins
+
+    def record(self, seconds, keys):
+        self.calls += 1
+        self.seconds += seconds
+        self.keys += keys
+        if seconds > 0:
+            b = int((math.log10(seconds) - _min_exponent) * _bins_per_decade)
+            self.histogram[min(max(b, 0), _n_bins - 1)] += 1
+        else:
+            self.histogram[0] += 1
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.seconds += other.seconds
+        self.keys += other.keys
+        self.histogram = [a + b for a, b in zip(self.histogram, other.histogram)]
+
+    def percentile(self, q):
+        ''' Latency (seconds) below which a fraction q of the calls fall:
+            the upper edge of the histogram bin holding that call. '''
+        if not self.calls:
+            return 0.0
+        rank = max(1, int(math.ceil(q * self.calls)))
+        seen = 0
+        for b, count in enumerate(self.histogram):
+            seen += count
+            if seen >= rank:
+                return 10 ** (float(b + 1) / _bins_per_decade + _min_exponent)
+        return 10 ** (float(_n_bins) / _bins_per_decade + _min_exponent)
+
+    def summary(self):
+        return {'calls' : self.calls, 'seconds' : self.seconds, 'keys' : self.keys,
+                'p50' : self.percentile(0.5), 'p99' : self.percentile(0.99)}
+
+class TemplateProfile(object):
+    ''' TemplateStats by template name. '''
+
+    def __init__(self):
+        self.templates = {}
+
+    def __len__(self):
+        return len(self.templates)
+
+    def record(self, template, seconds, keys):
+        try:
+            stats = self.templates[template]
+        except KeyError:
+            stats = self.templates[template] = TemplateStats()
+        stats.record(seconds, keys)
+
+    def merge(self, other):
+        for template, stats in other.templates.iteritems():
+            self.templates.setdefault(template, TemplateStats()).merge(stats)
+
+    def summary(self):
+        return dict((template, stats.summary()) for template, stats in self.templates.iteritems())
+
+    def table(self):
+        ''' Text table of the templates, most expensive first. '''
+        total = sum(stats.seconds for stats in self.templates.values()) or 1.0
+        lines = ['{0:<24}{1:>9}{2:>10}{3:>7}{4:>10}{5:>10}{6:>10}{7:>11}'.format(
+                 'template', 'calls', 'seconds', '%', 'mean ms', 'p50 ms', 'p99 ms', 'keys/call')]
+        for template, stats in sorted(self.templates.items(), key = lambda item: -item[1].seconds):
+            calls = stats.calls or 1
+            lines.append('{0:<24}{1:>9}{2:>10.3f}{3:>7.1f}{4:>10.3f}{5:>10.3f}{6:>10.3f}{7:>11.1f}'.format(
+                         template, stats.calls, stats.seconds, 100 * stats.seconds / total,
+                         1000 * stats.seconds / calls, 1000 * stats.percentile(0.5),
+                         1000 * stats.percentile(0.99), float(stats.keys) / calls))
+        return '\n'.join(lines)
+
+    def save(self, filename):
+        ''' Writes the summary of every template as JSON. '''
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(filename, 'w') as f:
+            json.dump(self.summary(), f, indent = 2, sort_keys = True)
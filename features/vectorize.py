@@ -0,0 +1,315 @@
+__author__ = 'chrisbillovits'
+
+''' Vectorization: featurizes straight into sparse matrix chunks.
+
+    Feature names are interned once into integer columns by a
+    FeatureVocabulary, the table shared by the training, dev and test data
+    of a model: it grows on training data and is frozen for evaluation.
+    Every example is written into CSR buffers as soon as it is featurized
+    and its dict is dropped, and fixed-size chunks of rows are emitted, so
+    no list of feature dicts is built and no DictVectorizer re-hashes
+    the names.  A HashingVocabulary can take the table's place when the
+    names should not be kept at all.  Dense templates bypass the table:
+    their values go to a float32 block next to the CSR rows (see
+    features/dense.py).  '''
+
+import os
+import sys
+
+"""Add root directory path"""
+root_dir = os.path.dirname(os.path.dirname(__file__))
+sys.path.append(root_dir)
+
+import numpy as np
+import scipy.sparse as sp
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.utils import murmurhash3_32
+from features import iter_featurize, dense_names
+from crossproduct import FeatureRow, PairCounts
+from dense import DenseFeatures, FeatureMatrix, split_dense, with_dense
+
+class FeatureVocabulary(BaseEstimator, TransformerMixin):
+    ''' Maps feature names to matrix columns.
+
+        While not frozen, unseen names are appended as new columns;
+        once frozen they are dropped.  As the first step of a pipeline it
+        stands in for DictVectorizer: the rows are already vectorized, so
+        fit only records the width of the training matrix, and transform
+        cuts wider matrices (columns added after fitting) back to it.  The
+        names are a constructor parameter so that grid-search clones of
+        the pipeline keep the training vocabulary.  '''
+
+    def __init__(self, feature_names = None, frozen = False):
+        self.feature_names = feature_names if feature_names is not None else []
+        self.frozen = frozen
+
+    @property
+    def feature_names_(self):
+        return self.feature_names
+
+    def _index(self):
+        # The name -> column dict is derived state, rebuilt if names were replaced.
+        index = self.__dict__.get('_column_index')
+        if index is None or len(index) != len(self.feature_names):
+            index = self.__dict__['_column_index'] = {name : i for i, name in enumerate(self.feature_names)}
+        return index
+
+    def __len__(self):
+        return len(self.feature_names)
+
+    def __getstate__(self):
+        # The lookup tables are rebuilt on demand, so saved pipelines and
+        # grid-search workers are not sent them.
+        state = dict(self.__dict__)
+        state.pop('_column_index', None)
+        state.pop('_pair_table', None)
+        return state
+
+    def column(self, name):
+        ''' Returns the column of name, adding it if allowed; None if dropped. '''
+        index = self._index()
+        col = index.get(name)
+        if col is None and not self.frozen:
+            col = index[name] = len(self.feature_names)
+            self.feature_names.append(name)
+        return col
+
+    def pair_columns(self, pairs):
+        ''' Columns of the (left, right) names of a PairCounts, None where
+            dropped.  Tokens get ids in a table of their own, so a pair is
+            looked up by the code (left id << 32 | right id) and its name
+            is only built the first time it is seen. '''
+        table = self.__dict__.get('_pair_table')
+        if table is None or table[0] is not self.feature_names:
+            table = self.__dict__['_pair_table'] = (self.feature_names, {}, {})
+        names, token_ids, pair_columns = table
+        left = np.array([token_ids.setdefault(t, len(token_ids)) for t in pairs.left], dtype = np.int64)
+        right = np.array([token_ids.setdefault(t, len(token_ids)) for t in pairs.right], dtype = np.int64)
+        codes = ((left[pairs.i] << 32) | right[pairs.j]).tolist()
+        columns = map(pair_columns.get, codes)
+        if None in columns:
+            i, j = pairs.i.tolist(), pairs.j.tolist()
+            for k, col in enumerate(columns):
+                if col is None:
+                    col = columns[k] = self.column((pairs.left[i[k]], pairs.right[j[k]]))
+                    if col is not None:
+                        pair_columns[codes[k]] = col
+        return columns
+
+    def vectorize(self, dicts):
+        ''' Turns a list of feature dicts into a CSR matrix. '''
+        builder = RowBuilder(self)
+        for d in dicts:
+            builder.add(d)
+        return builder.tomatrix()
+
+    def remap(self, X, names):
+        ''' Re-expresses matrix X, whose columns are the given names,
+            in this vocabulary's columns. '''
+        cols = [self.column(name) for name in names]
+        keep = [i for i, col in enumerate(cols) if col is not None]
+        target = np.array([cols[i] for i in keep], dtype = np.int64)
+        X = sp.csr_matrix(X)[:, keep].tocoo()
+        return sp.csr_matrix((X.data, (X.row, target[X.col])), shape = (X.shape[0], len(self)))
+
+    def fit(self, X, y = None):
+        self.n_features_ = len(self) if isinstance(X, list) else split_dense(X)[0].shape[1]
+        return self
+
+    def transform(self, X):
+        if isinstance(X, list):
+            frozen, self.frozen = self.frozen, True
+            X = self.vectorize(X)
+            self.frozen = frozen
+        X, dense = split_dense(X)
+        width = getattr(self, 'n_features_', X.shape[1])
+        if X.shape[1] > width:
+            X = sp.csr_matrix(X)[:, :width]
+        elif X.shape[1] < width:
+            X = sp.csr_matrix(X)
+            X = sp.csr_matrix((X.data, X.indices, X.indptr), shape = (X.shape[0], width))
+        return with_dense(X, dense)
+
+class HashingVocabulary(BaseEstimator, TransformerMixin):
+    ''' Stand-in for FeatureVocabulary that hashes feature names instead
+        of storing them, so memory stays fixed however many names appear.
+
+        Rows are built in a base space of 2 ** (base_bits + 1) columns:
+        the low base_bits bits of the murmurhash3 of a name, and one more
+        bit for its sign.  As a pipeline step it folds that space down to
+        2 ** n_bits columns (n_bits <= base_bits), so n_bits can be swept
+        in a parameter grid without featurizing again.  With signed set,
+        colliding values are added with +/- signs and the absolute value is
+        taken afterwards, which keeps the matrix valid for chi2.  '''
+
+    def __init__(self, n_bits = 18, signed = False, base_bits = None, frozen = False):
+        self.n_bits = n_bits
+        self.signed = signed
+        self.base_bits = base_bits
+        self.frozen = frozen
+
+    def _base_bits(self):
+        return self.base_bits if self.base_bits is not None else self.n_bits
+
+    @property
+    def feature_names_(self):
+        return None
+
+    def __len__(self):
+        return 2 ** (self._base_bits() + 1)
+
+    def column(self, name):
+        if not isinstance(name, basestring):
+            name = repr(name)
+        elif isinstance(name, unicode):
+            name = name.encode('utf-8')
+        return murmurhash3_32(name, positive = True) & (len(self) - 1)
+
+    def vectorize(self, dicts):
+        builder = RowBuilder(self)
+        for d in dicts:
+            builder.add(d)
+        return builder.tomatrix()
+
+    def fit(self, X, y = None):
+        return self
+
+    def transform(self, X):
+        if isinstance(X, list):
+            X = self.vectorize(X)
+        base_bits = self._base_bits()
+        if self.n_bits > base_bits:
+            raise ValueError('n_bits = {0} exceeds the {1} bits the rows were hashed with'.format(self.n_bits, base_bits))
+        X, dense = split_dense(X)
+        X = sp.csr_matrix(X).tocoo()
+        cols = X.col & (2 ** self.n_bits - 1)
+        data = X.data
+        if self.signed:
+            data = np.where((X.col >> base_bits) & 1, -data, data)
+        X = sp.csr_matrix((data, (X.row, cols)), shape = (X.shape[0], 2 ** self.n_bits))
+        if self.signed:
+            X = abs(X)
+        return with_dense(X, dense)
+
+class RowBuilder(object):
+    ''' Accumulates feature dicts as CSR buffers against a vocabulary, and
+        the DenseFeatures of the templates whose columns are dense_names
+        in a float32 block. '''
+
+    def __init__(self, vocabulary, dense_names = ()):
+        self.vocabulary = vocabulary
+        self.dense_names = list(dense_names)
+        self.indptr = [0]
+        self.indices = []
+        self.data = []
+        self.dense = np.zeros((256 if self.dense_names else 0, len(self.dense_names)), dtype = np.float32)
+
+    def __len__(self):
+        return len(self.indptr) - 1
+
+    def _add_dense(self, parts):
+        row = len(self)
+        if row == len(self.dense):
+            self.dense = np.concatenate((self.dense, np.zeros_like(self.dense)))
+        start = 0
+        for part in parts:
+            self.dense[row, start:start + len(part)] = part.values
+            start += len(part)
+        if start != len(self.dense_names):
+            raise ValueError('row has {0} dense values, expected {1}'.format(start, len(self.dense_names)))
+
+    def add(self, feats):
+        ''' Adds a row: a feature dict, PairCounts, DenseFeatures or FeatureRow.
+            Without dense_names, DenseFeatures are treated as a dict. '''
+        column = self.vocabulary.column
+        if self.dense_names:
+            parts = feats.parts if isinstance(feats, FeatureRow) else [feats]
+            self._add_dense([part for part in parts if isinstance(part, DenseFeatures)])
+            feats = FeatureRow()
+            for part in parts:
+                if not isinstance(part, DenseFeatures):
+                    feats.add(part)
+        if isinstance(self.vocabulary, HashingVocabulary) and not isinstance(feats, dict):
+            # Hashed names that collide add up, so merge by name first.
+            feats = feats.as_dict() if isinstance(feats, FeatureRow) else dict(feats.iteritems())
+        parts = feats.parts if isinstance(feats, FeatureRow) else [feats]
+        if len(parts) == 1 and not isinstance(parts[0], PairCounts):
+            for name, value in parts[0].iteritems():
+                col = column(name)
+                if col is not None:
+                    self.indices.append(col)
+                    self.data.append(value)
+        else:
+            row = {} # later parts override earlier ones
+            for part in parts:
+                if isinstance(part, PairCounts):
+                    for col, value in zip(self.vocabulary.pair_columns(part), part.counts.tolist()):
+                        if col is not None:
+                            row[col] = value
+                else:
+                    for name, value in part.iteritems():
+                        col = column(name)
+                        if col is not None:
+                            row[col] = value
+            self.indices.extend(row.iterkeys())
+            self.data.extend(row.itervalues())
+        self.indptr.append(len(self.indices))
+
+    def tomatrix(self):
+        ''' Returns the accumulated rows and empties the buffers: a CSR
+            matrix, or a FeatureMatrix if there are dense_names. '''
+        X = sp.csr_matrix((np.array(self.data, dtype = np.float64),
+                           np.array(self.indices, dtype = np.int32),
+                           np.array(self.indptr, dtype = np.int32)),
+                          shape = (len(self), len(self.vocabulary)))
+        if self.dense_names:
+            X = FeatureMatrix(X, self.dense[:len(self)].copy())
+        self.indptr, self.indices, self.data = [0], [], []
+        return X
+
+def compact(X):
+    ''' Copy of CSR matrix X whose values use the smallest dtype that holds
+        them exactly (most features are small counts), for saving.  The
+        dense block of a FeatureMatrix stays float32. '''
+    if isinstance(X, FeatureMatrix):
+        return FeatureMatrix(compact(X.sparse), X.dense)
+    data = X.data
+    for dtype in (np.int8, np.int16, np.int32, np.float32):
+        if np.array_equal(data.astype(dtype), data):
+            data = data.astype(dtype)
+            break
+    return sp.csr_matrix((data, X.indices, X.indptr), shape = X.shape)
+
+def stream_vectors(reader, features_funcs, vocabulary, chunk_size = 1000, n_jobs = 1):
+    ''' Yields (CSR chunk, labels) for every chunk_size pairs of reader.
+        A chunk is as wide as the vocabulary was when it was emitted. '''
+    builder = RowBuilder(vocabulary, dense_names(features_funcs))
+    labels = []
+    for feat_dict, label in iter_featurize(reader, features_funcs, n_jobs):
+        builder.add(feat_dict)
+        labels.append(label)
+        if len(builder) == chunk_size:
+            yield builder.tomatrix(), labels
+            labels = []
+    if len(builder):
+        yield builder.tomatrix(), labels
+
+def stack_chunks(chunks, width):
+    ''' Stacks CSR chunks of growing width into one matrix of the given
+        width; FeatureMatrix chunks stack into a FeatureMatrix. '''
+    if chunks and isinstance(chunks[0], FeatureMatrix):
+        return FeatureMatrix(stack_chunks([X.sparse for X in chunks], width),
+                             np.concatenate([X.dense for X in chunks]))
+    chunks = [sp.csr_matrix((X.data, X.indices, X.indptr), shape = (X.shape[0], width)) for X in chunks]
+    if not chunks:
+        return sp.csr_matrix((0, width))
+    return sp.vstack(chunks, format = 'csr')
+
+def streamed_featurizer(reader, features_funcs, vocabulary, chunk_size = 1000, n_jobs = 1):
+    ''' Streams reader into a single CSR matrix and its labels; the list
+        of feature dicts is never built. '''
+    chunks, labels = [], []
+    for X, chunk_labels in stream_vectors(reader, features_funcs, vocabulary, chunk_size, n_jobs):
+        chunks.append(X)
+        labels.extend(chunk_labels)
+    return stack_chunks(chunks, len(vocabulary)), labels
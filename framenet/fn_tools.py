@@ -1,49 +1,129 @@
 __author__ = 'guthriec'
 
-from framenet.frame import Frame
+''' Compiled FrameNet frame hierarchy.
+
+    frameIndex.xml and frRelation.xml are parsed once into a FrameIndex:
+    integer ids for the frame names plus a bit matrix whose row i marks
+    every super frame of frame i.  A frame's super frames are itself, the
+    frames it is directly related to (any relation type, as before), and
+    every frame reached through a chain of Inheritance relations.  The
+    index is cached in framenet/frame_index.npz, rebuilt when either XML
+    file changes, and only loaded on first use. '''
+
 import os
 import sys
+import numpy as np
 import xml.etree.ElementTree as ET
 
 """Add root directory path"""
 root_dir = os.path.dirname(os.path.dirname(__file__))
 sys.path.append(root_dir)
-print root_dir
 
-index_tree = ET.parse('framenet/frameIndex.xml')
-relation_tree = ET.parse('framenet/frRelation.xml')
+_ns = '{http://framenet.icsi.berkeley.edu}'
+_index_file = os.path.join(root_dir, 'framenet', 'frameIndex.xml')
+_relation_file = os.path.join(root_dir, 'framenet', 'frRelation.xml')
+_cache_file = os.path.join(root_dir, 'framenet', 'frame_index.npz')
+_closed_relations = ('Inheritance',)
+
+def _source_stamp():
+    return np.array([os.path.getsize(f) for f in (_index_file, _relation_file)] +
+                    [int(os.path.getmtime(f)) for f in (_index_file, _relation_file)], dtype = np.int64)
+
+def _transitive_closure(M):
+    ''' Reflexive, transitive closure of a square bool matrix, by squaring. '''
+    closure = M | np.eye(len(M), dtype = bool)
+    while True:
+        step = closure.astype(np.float32).dot(closure.astype(np.float32)) > 0
+        if (step == closure).all():
+            return closure
+        closure = step
+
+class FrameIndex(object):
+    ''' Frame names, their FrameNet IDs and the super frame bit matrix. '''
+
+    def __init__(self, names, fn_ids, closure):
+        self.names = list(names)
+        self.fn_ids = list(fn_ids)
+        self.closure = closure
+        self.ids = {name : i for i, name in enumerate(self.names)}
 
-name_id_dict = {}
-index_root = index_tree.getroot()
-for frame in index_root.iter('{http://framenet.icsi.berkeley.edu}frame'):
-    name_id_dict[frame.get('name')] = frame.get('ID')
+    @classmethod
+    def from_xml(cls, index_file = _index_file, relation_file = _relation_file):
+        names, fn_ids = [], []
+        for frame in ET.parse(index_file).getroot().iter(_ns + 'frame'):
+            names.append(frame.get('name'))
+            fn_ids.append(frame.get('ID'))
+        ids = {name : i for i, name in enumerate(names)}
 
-super_frame_dict = {}
-relation_root = relation_tree.getroot()
+        direct = np.zeros((len(names), len(names)), dtype = bool)
+        closed = np.zeros_like(direct)
+        for relation_type in ET.parse(relation_file).getroot().iter(_ns + 'frameRelationType'):
+            for relation in relation_type.iter(_ns + 'frameRelation'):
+                sub_frame = ids.get(relation.get('subFrameName'))
+                super_frame = ids.get(relation.get('superFrameName'))
+                if sub_frame is None or super_frame is None:
+                    continue
+                direct[sub_frame, super_frame] = True
+                if relation_type.get('name') in _closed_relations:
+                    closed[sub_frame, super_frame] = True
+        return cls(names, fn_ids, direct | _transitive_closure(closed))
 
-for relation in relation_root.iter('{http://framenet.icsi.berkeley.edu}frameRelation'):
-    sub_frame = relation.get('subFrameName')
-    super_frame = relation.get('superFrameName')
-    if sub_frame in super_frame_dict:
-        super_frame_dict[sub_frame].append(super_frame)
-    else:
-        super_frame_dict[sub_frame] = [super_frame]
+    def save(self, filename):
+        np.savez(filename, names = np.array(self.names), fn_ids = np.array(self.fn_ids),
+                 closure = np.packbits(self.closure, axis = 1), stamp = _source_stamp())
 
-for name in name_id_dict:
-    if name in super_frame_dict:
-        super_frame_dict[name].append(name)
-    else:
-        super_frame_dict[name] = [name]
+    @classmethod
+    def load(cls, filename):
+        ''' Loads a saved index; None if it is missing or out of date. '''
+        if not os.path.isfile(filename):
+            return None
+        arrays = np.load(filename)
+        if not np.array_equal(arrays['stamp'], _source_stamp()):
+            return None
+        names = arrays['names'].tolist()
+        closure = np.unpackbits(arrays['closure'], axis = 1)[:, :len(names)].astype(bool)
+        return cls(names, arrays['fn_ids'].tolist(), closure)
+
+    def frame_ids(self, names):
+        ''' Integer ids of the names, -1 for frames not in FrameNet. '''
+        return np.array([self.ids.get(name, -1) for name in names], dtype = np.int64)
+
+    def super_frame_matrix(self, names1, names2):
+        ''' Bool matrix whose (i, j) entry tells if names2[j] is a super
+            frame of names1[i]; unknown frames have no super frames. '''
+        ids1, ids2 = self.frame_ids(names1), self.frame_ids(names2)
+        M = self.closure[ids1][:, ids2]
+        M[ids1 < 0, :] = False
+        M[:, ids2 < 0] = False
+        return M
+
+_frame_index = None
+
+def frame_index():
+    ''' The FrameIndex, compiled from the XML on first use if not cached. '''
+    global _frame_index
+    if _frame_index is None:
+        _frame_index = FrameIndex.load(_cache_file)
+        if _frame_index is None:
+            _frame_index = FrameIndex.from_xml()
+            _frame_index.save(_cache_file)
+    return _frame_index
 
 def name_to_id(frame_name):
-    return name_id_dict[frame_name]
+    index = frame_index()
+    return index.fn_ids[index.ids[frame_name]]
 
 def super_frame_names(frame):
-    return super_frame_dict[frame.name]
+    index = frame_index()
+    return [index.names[i] for i in np.flatnonzero(index.closure[index.ids[frame.name]])]
 
 def is_super_frame(f1, f2):
     # is f2 a super frame of f1?
-    if f2.name in super_frame_dict[f1.name]:
-        return True
-    else:
-        return False
\ No newline at end of file
+    return bool(frame_index().super_frame_matrix([f1.name], [f2.name])[0, 0])
+
+def super_frame_pairs(frames1, frames2):
+    ''' (i, j) index pairs, i-major, of frames2[j] being a super frame of frames1[i]. '''
+    if not frames1 or not frames2:
+        return []
+    M = frame_index().super_frame_matrix([f.name for f in frames1], [f.name for f in frames2])
+    return zip(*np.nonzero(M))
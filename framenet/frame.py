@@ -3,7 +3,7 @@ __author__ = 'guthriec'
 from nltk.stem.snowball import *
 stemmer = SnowballStemmer("english")
 
-class Frame:
+class Frame(object):
     def __init__(self, text, annotation_xml):
         if annotation_xml.tag != 'annotationSet':
             raise ValueError('annotation_xml must be an annotationSet')
@@ -17,6 +17,15 @@ class Frame:
             label_text = text[start:(end+1)]
             self.labels[label_name] = label_text
 
+    @classmethod
+    def from_fields(cls, name, text, labels):
+        ''' Rebuilds a frame from its already extracted fields. '''
+        frame = cls.__new__(cls)
+        frame.name = name
+        frame.text = text
+        frame.labels = labels
+        return frame
+
     def __str__(self):
         return self.text + ' ' + self.name + ' ' + ' '.join([label + ': ' + stemmer.stem(word) for (label, word) in self.labels.iteritems()])
 
@@ -10,22 +10,24 @@ root_dir = os.path.dirname(os.path.dirname(__file__))
 sys.path.append(root_dir)
 
 import numpy as np
-import cPickle as pickle
+import hashlib
 import time
 
 from features.features import word_cross_product_features, word_overlap_features, hypernym_features, featurizer
+from features.vectorize import FeatureVocabulary, HashingVocabulary, streamed_featurizer
+from features.store import FeatureStore
 from sklearn.feature_selection import SelectFpr, chi2, SelectKBest, RFE
-from sklearn.feature_extraction import DictVectorizer
 from sklearn.pipeline import Pipeline
 from sklearn.ensemble import RandomForestClassifier, ExtraTreesClassifier
 from sklearn.linear_model import LogisticRegression, SGDClassifier
 from sklearn.naive_bayes import MultinomialNB as MultNB
 from sklearn.svm import SVC
-from util.utils import sick_train_reader, sick_dev_reader, sick_train_dev_reader, sick_test_reader
+from util.utils import sick_train_reader, sick_dev_reader, sick_train_dev_reader, sick_test_reader, reader_split
 from util.colors import color, prettyPrint
 from sklearn import metrics
 from sklearn.grid_search import GridSearchCV
 from sklearn.decomposition import TruncatedSVD
+from sklearn.externals import joblib
 
 _models = {"forest" : RandomForestClassifier(n_estimators = 17, criterion = 'entropy', n_jobs = -1),
            "extra_tree" : ExtraTreesClassifier(n_estimators = 100, criterion = 'entropy', n_jobs = -1, max_features = None,
@@ -52,61 +54,93 @@ _param_grid = { "forest" : {},
                                                                 
                }
 
-def save_vectors (feat_vec = None, labels = None, file_extension = None):
-    """ Saves the feature vectors and classification labels under the given file extension.  """
-
-    feat_file_name = 'output/' + file_extension + '.feature'
-    label_file_name = 'output/' + file_extension + '.label'
-
-    prettyPrint('Saving feature vector file: {0} ... \n'
-                'Saving Labels file: {1} ... '.format(feat_file_name, label_file_name), color.CYAN)
-
-    #Save feature vector to disk
-    with open(feat_file_name, 'w') as f:
-        pickle.dump(feat_vec, f)
-    #Save label file
-    with open(label_file_name, 'w') as f:
-        pickle.dump(labels, f)
-
-def load_vectors (file_extension = None):
-    """ Loads the feature vector and classification labels from the
-        canonical output files in output.  If the file does not exist,
-        the load is aborted. 
-    """
-    
-    feat_file_name = 'output/' + file_extension + '.feature'
-    label_file_name = 'output/' + file_extension + '.label'
-    
-    prettyPrint( "Loading feature vectors and labels from disk ... ", color.CYAN)
-    if not os.path.isfile(feat_file_name) or not os.path.isfile(label_file_name):
-        prettyPrint("Feature vector files {0} could not be found.  Generating from scratch instead ...".format(feat_file_name), color.CYAN)
-        return None, None
-    with open(feat_file_name, 'r') as f:
-        feat_vec = pickle.load(f)
-    with open(label_file_name, 'r') as f:
-        labels = pickle.load(f)
-
-    prettyPrint ("Done loading feature vectors.", color.CYAN)
-    return feat_vec, labels
-
-def obtain_vectors(file_extension = None, load_vec = True, reader = None, features = None):
-    ''' Loads feature vectors either from file, or generates them anew.
-        If the path doesn't exist, the load_vec flag is ignored. '''
-    feat_vec, labels = None, None
+feature_store = FeatureStore()
+
+def fingerprint(obj):
+    ''' Hex md5 of repr(obj), for tagging saved artifacts with what produced them. '''
+    return hashlib.md5(repr(obj)).hexdigest()
+
+def pipeline_file(file_extension, config_hash, feature_hash):
+    ''' Name of the fitted pipeline saved for a configuration and feature cache. '''
+    return 'output/{0}.{1}.{2}.model'.format(file_extension, config_hash[:12], feature_hash[:12])
+
+def save_pipeline(pipeline, filename, config_hash, feature_hash):
+    ''' Saves a fitted pipeline (vocabulary, selector, classifier) with
+        joblib, uncompressed so that the numpy arrays estimators hold
+        directly (selector scores, linear coefficients) are memory-mapped
+        when loaded.  Trees are not: sklearn copies their node and value
+        arrays into its own buffers when unpickling, so a forest is read
+        into memory in full (about 0.7s for 1000 fully grown trees on
+        SICK-sized data, 175MB).  The hashes are stored alongside and
+        checked by load_pipeline. '''
+    prettyPrint("Saving fitted pipeline: {0} ... ".format(filename), color.CYAN)
+    directory = os.path.dirname(filename)
+    if directory and not os.path.isdir(directory):
+        os.makedirs(directory)
+    joblib.dump({'pipeline' : pipeline, 'config_hash' : config_hash, 'feature_hash' : feature_hash}, filename)
+
+def load_pipeline(filename, config_hash, feature_hash):
+    ''' Loads a pipeline saved by save_pipeline, or returns None if the
+        file does not exist or was fitted under other hashes. '''
+    if not os.path.isfile(filename):
+        prettyPrint("Fitted pipeline {0} could not be found.".format(filename), color.CYAN)
+        return None
+    start = time.time()
+    saved = joblib.load(filename, mmap_mode = 'r')
+    if (saved['config_hash'], saved['feature_hash']) != (config_hash, feature_hash):
+        prettyPrint("Fitted pipeline {0} is stale: it was fitted under another configuration "
+                    "or feature cache.".format(filename), color.CYAN)
+        return None
+    prettyPrint("Loaded fitted pipeline {0} in {1:.2f} seconds.".format(filename, time.time() - start), color.CYAN)
+    return saved['pipeline']
+
+def obtain_vectors(file_extension = None, load_vec = True, reader = None, features = None, n_jobs = 1,
+                   vocabulary = None, chunk_size = 1000):
+    ''' Loads feature vectors either from the feature store, or generates them anew, as a
+        CSR matrix whose columns follow vocabulary (a FeatureVocabulary
+        or HashingVocabulary; a new FeatureVocabulary if not given).  n_jobs featurizer processes are used
+        when generating, and rows are built chunk_size at a time.  With
+        dense templates among the features (e.g. glv_diff) it is a
+        FeatureMatrix whose dense block the pipeline's first step stacks
+        onto the CSR part.
+
+        With load_vec, each template is taken from the per-template
+        feature store (see features/store.py): only the templates that
+        are new to the store, or whose data or code changed, are
+        computed, and templates dropped from features are simply not
+        assembled.  Readers other than the sick_*_reader functions are
+        always featurized anew.  file_extension names the vector set in
+        progress messages. '''
+    if vocabulary is None:
+        vocabulary = FeatureVocabulary()
+    if load_vec and reader_split(reader) is None:
+        prettyPrint("The feature store only holds the SICK splits; featurizing {0} without it".format(file_extension), color.YELLOW)
+        load_vec = False
     if load_vec:
-        feat_vec, labels = load_vectors(file_extension)
-    if not load_vec or not feat_vec:
-        feat_vec, labels = featurizer(reader, features)
-        save_vectors(feat_vec, labels, file_extension)
-    return feat_vec, labels
+        prettyPrint("Assembling feature vectors {0} from the feature store ... ".format(file_extension), color.CYAN)
+        return feature_store.assemble(features, reader, vocabulary, n_jobs)
+    return streamed_featurizer(reader, features, vocabulary, chunk_size, n_jobs)
 
-def build_model(clf = "log_reg", train_reader = sick_train_reader, feature_vectorizer = DictVectorizer(sparse = True), 
+def build_model(clf = "log_reg", train_reader = sick_train_reader, feature_vectorizer = None,
                 features = None, feature_selector = SelectFpr(chi2, alpha = 0.05),
                 file_name = None, load_vec = None,
-                compression = None):
-    ''' Builds the model of choice. ''' 
+                compression = None, n_jobs = 1, chunk_size = 1000, hash_bits = None, signed_hash = False):
+    ''' Builds the model of choice.  The training data is vectorized
+        against a FeatureVocabulary (a new one unless feature_vectorizer
+        is given), which is also the first pipeline step and later
+        vectorizes the evaluation data.  Given hash_bits, feature names
+        are hashed into 2 ** hash_bits columns instead (see
+        HashingVocabulary); dict_vector__n_bits may then be tuned up to
+        hash_bits. ''' 
     global _models
 
+    if feature_vectorizer is not None:
+        vocabulary = feature_vectorizer
+    elif hash_bits:
+        vocabulary = HashingVocabulary(n_bits = hash_bits, signed = signed_hash, base_bits = hash_bits)
+    else:
+        vocabulary = FeatureVocabulary()
+
     clf_pipe = None
     '''
     Putting RFE in the pipeline 
@@ -116,15 +150,15 @@ def build_model(clf = "log_reg", train_reader = sick_train_reader, feature_vecto
     '''
  
     if compression:
-        clf_pipe = Pipeline([('dict_vector', feature_vectorizer),
+        clf_pipe = Pipeline([('dict_vector', vocabulary),
                             ('feature_selector', feature_selector),
                             ('compression', _models[compression]), ('clf', _models[clf])])
     else:
-        clf_pipe = Pipeline([('dict_vector', feature_vectorizer),
+        clf_pipe = Pipeline([('dict_vector', vocabulary),
                             ('feature_selector', feature_selector),
                             ('clf', _models[clf])])
 
-    feat_vec, labels = obtain_vectors(file_name, load_vec, train_reader, features)
+    feat_vec, labels = obtain_vectors(file_name, load_vec, train_reader, features, n_jobs, vocabulary, chunk_size)
     
     return clf_pipe, feat_vec, labels
 
@@ -153,8 +187,11 @@ def parameter_tune (model = 'log_reg', pipeline = None, feat_vec = None, labels
 
     return grid_search.best_estimator_
 
-def evaluate_model(pipeline = None, reader = sick_dev_reader, features = None, file_name = "", load_vec = None):
-    """Evaluates the given model on the test data and outputs statistics."""
+def evaluate_model(pipeline = None, reader = sick_dev_reader, features = None, file_name = "", load_vec = None, n_jobs = 1,
+                   chunk_size = 1000):
+    """Evaluates the given model on the test data and outputs statistics.
+    The evaluation data is vectorized against the (now frozen) training
+    vocabulary of the pipeline."""
     if reader == sick_dev_reader:
         reader_name = 'Dev'
     elif reader == sick_train_reader:
@@ -166,7 +203,10 @@ def evaluate_model(pipeline = None, reader = sick_dev_reader, features = None, f
 
     if len(pipeline.steps) == 2: #Only have a vectorizer and a classifier step in pipeline
         dict_vectorizer = pipeline.steps[0][1]
-        print reader_name + ' Feature Set Size: ', len(dict_vectorizer.feature_names_)
+        if isinstance(dict_vectorizer, HashingVocabulary):
+            print reader_name + ' Feature Set Size: ', 2 ** dict_vectorizer.n_bits, '(hashed)'
+        else:
+            print reader_name + ' Feature Set Size: ', len(dict_vectorizer.feature_names_)
     else:
         feature_selector = pipeline.steps[1][1] #Extracts the dictVectorizer from the pipeline object (assumes feature vectorizer is first transform applied)
         print reader_name + ' Feature Set Size: ', len(feature_selector.get_support(True))
@@ -185,7 +225,9 @@ def evaluate_model(pipeline = None, reader = sick_dev_reader, features = None, f
     else:
         reader = sick_test_reader
         file_name += ".test"
-    feat_vec, gold_labels = obtain_vectors(file_name, load_vec, reader, features)
+    vocabulary = pipeline.steps[0][1]
+    vocabulary.set_params(frozen = True)
+    feat_vec, gold_labels = obtain_vectors(file_name, load_vec, reader, features, n_jobs, vocabulary, chunk_size)
     
     predicted_labels = pipeline.predict(feat_vec)
     prettyPrint( metrics.classification_report(gold_labels, predicted_labels, digits = 5), prettyColor)
@@ -4,21 +4,25 @@ from framenet.frame import Frame
 import xml.etree.ElementTree as ET
 
 def frametuples(filename):
-    tree = ET.parse(filename)
-    root = tree.getroot()
-    sentences = []
-    next_s_id = 0
-    for sentence in root.iter('sentence'):
-        s_id = int(sentence.get('ID'))
-        next_s_id += 1
-        annotation_sets = sentence.iter('annotationSet')
-        text = sentence.find('text').text
-        frame_list = []
-        for annotation_set in annotation_sets:
-            full_frame = Frame(text, annotation_set)
-            frame_list.append(full_frame)
-        sentences.append(frame_list)
-    tuples = []
-    for i in range(0, len(sentences)-1, 2):
-        tuples.append((sentences[i], sentences[i+1]))
-    return tuples
+    ''' Yields the (frames of sentence 2i, frames of sentence 2i + 1) pairs
+        of a SEMAFOR output file.  The XML is read incrementally and each
+        sentence is detached from the tree once its frames are built, so
+        memory does not grow with the file. '''
+    open_elems = []
+    pending = None
+    for event, elem in ET.iterparse(filename, events = ('start', 'end')):
+        if event == 'start':
+            open_elems.append(elem)
+            continue
+        open_elems.pop()
+        if elem.tag != 'sentence':
+            continue
+        text = elem.find('text').text
+        frame_list = [Frame(text, annotation_set) for annotation_set in elem.iter('annotationSet')]
+        if open_elems:
+            open_elems[-1].remove(elem)
+        if pending is None:
+            pending = frame_list
+        else:
+            yield (pending, frame_list)
+            pending = None
@@ -0,0 +1,146 @@
+__author__ = 'chrisbillovits'
+
+'''Benchmark suite: times every feature template, the readers, vectorization,
+   chi2 selection and every model of models._models on a fixed sample of the
+   SICK dev split (its first --sample pairs).  Each timing is the best of
+   --repeats runs.  Templates are timed one at a time from a cold sentence
+   analysis cache, so a template is charged for the analysis it needs; other
+   caches (WordNet, GloVe) are warm after the first run.  A benchmark that
+   cannot run here (e.g. missing GloVe or WordNet data) records its error.
+
+   Results are written as JSON to --output and compared with the --baseline
+   JSON, if present; ratios above --tolerance are flagged as regressions
+   (unless the slowdown is under a millisecond, which is noise).
+   With --save_baseline the results also become the new baseline.'''
+
+import sys
+import os
+import json
+import time
+import platform
+import itertools
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath((__file__))))
+sys.path.append(root_dir)
+os.chdir(root_dir)
+
+from argparse import ArgumentParser
+import numpy as np
+import scipy
+import sklearn
+from sklearn.base import clone
+from sklearn.feature_extraction import DictVectorizer
+from sklearn.feature_selection import SelectKBest, chi2
+from util.utils import str2tree, data_files, sick_dev_reader
+from util.colors import color, prettyPrint
+from semafor.process_semafor import frametuples
+from features.features import features_mapping, template_features, featurizer
+from features.sentence import clear_analysis_cache
+from features.vectorize import FeatureVocabulary
+from models.models import _models
+from parse_benchmark import read_parses
+
+_vector_templates = ['word_overlap', 'word_cross_product', 'bigram_cross_prod', 'length']
+
+def best_time(func, repeats, setup = None):
+    ''' Best wall-clock time of func() over repeats runs; setup() runs untimed before each. '''
+    best = float('inf')
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.time()
+        func()
+        best = min(best, time.time() - start)
+    return best
+
+def measure(results, name, func, repeats, setup = None):
+    try:
+        results[name] = best_time(func, repeats, setup)
+        prettyPrint("{0:<40}{1:>10.4f}s".format(name, results[name]), color.CYAN)
+    except Exception as e:
+        message = ([line.strip() for line in str(e).split('\n') if line.strip(' *')] or [''])[0]
+        results[name] = {'error' : '{0}: {1}'.format(type(e).__name__, message)}
+        prettyPrint("{0:<40}{1}".format(name, results[name]['error']), color.RED)
+
+def run_benchmarks(sample, repeats, templates):
+    results = {}
+    examples = list(itertools.islice(sick_dev_reader(), sample))
+    parses = read_parses(data_files['dev'][0])[:2 * sample]
+
+    measure(results, 'readers/str2tree', lambda: [str2tree(s) for s in parses], repeats)
+    measure(results, 'readers/frametuples',
+            lambda: list(itertools.islice(frametuples(data_files['dev'][1]), sample)), repeats)
+    measure(results, 'readers/sick_dev_reader', lambda: list(itertools.islice(sick_dev_reader(), sample)), repeats)
+
+    for template in templates:
+        measure(results, 'templates/' + template,
+                lambda: [template_features([template], t1, t2, sf1, sf2) for label, t1, t2, sf1, sf2 in examples],
+                repeats, setup = clear_analysis_cache)
+
+    reader = lambda: iter(examples)
+    try:
+        feats, labels = featurizer(reader, _vector_templates)
+    except Exception as e:
+        prettyPrint("Cannot featurize the sample: {0}".format(e), color.RED)
+        return results
+    measure(results, 'vectorize/DictVectorizer', lambda: DictVectorizer().fit_transform(feats), repeats)
+    measure(results, 'vectorize/FeatureVocabulary', lambda: FeatureVocabulary().vectorize(feats), repeats)
+    X = FeatureVocabulary().vectorize(feats)
+    measure(results, 'selection/chi2', lambda: SelectKBest(chi2, k = 'all').fit_transform(X, labels), repeats)
+
+    for name, model in sorted(_models.items()):
+        fitted = []
+        measure(results, 'models/{0}/fit'.format(name), lambda: fitted.append(clone(model).fit(X, labels)), repeats)
+        if not fitted:
+            continue
+        apply = fitted[-1].predict if hasattr(fitted[-1], 'predict') else fitted[-1].transform
+        measure(results, 'models/{0}/{1}'.format(name, apply.__name__), lambda: apply(X), repeats)
+    return results
+
+def compare(results, baseline, tolerance):
+    ''' {name : current / baseline time} for the benchmarks timed in both;
+        prints them and returns the names of the regressions. '''
+    ratios = {}
+    for name in sorted(results):
+        old, new = baseline.get(name), results[name]
+        if isinstance(old, float) and isinstance(new, float) and old > 0:
+            ratios[name] = new / old
+    regressions = [name for name, ratio in ratios.iteritems()
+                   if ratio > tolerance and results[name] - baseline[name] > 1e-3]
+    for name in sorted(ratios):
+        prettyPrint("{0:<40}{1:>10.4f}s -> {2:>8.4f}s  x{3:.2f}".format(name, baseline[name], results[name], ratios[name]),
+                    color.RED if name in regressions else color.GREEN)
+    return ratios, sorted(regressions)
+
+if __name__ == '__main__':
+    parser = ArgumentParser('description = benchmark feature templates, readers, vectorization and models')
+    parser.add_argument('--sample', type = int, default = 200, help = 'number of dev pairs to benchmark on')
+    parser.add_argument('--repeats', type = int, default = 3, help = 'timing repetitions (best is kept)')
+    parser.add_argument('--templates', nargs = '*', default = sorted(features_mapping), help = 'templates to time')
+    parser.add_argument('--output', default = 'output/benchmark.json', help = 'JSON file for the results')
+    parser.add_argument('--baseline', default = 'output/benchmark_baseline.json', help = 'JSON results to compare with')
+    parser.add_argument('--tolerance', type = float, default = 1.2, help = 'slowdown ratio flagged as a regression')
+    parser.add_argument('--save_baseline', action = 'store_true', help = 'also store the results as the baseline')
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.sample, args.repeats, args.templates)
+    report = {'meta' : {'sample' : args.sample, 'repeats' : args.repeats, 'python' : platform.python_version(),
+                        'numpy' : np.__version__, 'scipy' : scipy.__version__, 'sklearn' : sklearn.__version__,
+                        'time' : time.strftime('%Y-%m-%d %H:%M:%S')},
+              'results' : results}
+    if os.path.isfile(args.baseline):
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        prettyPrint("Comparison with {0}:".format(args.baseline), color.YELLOW)
+        ratios, regressions = compare(results, baseline['results'], args.tolerance)
+        report['comparison'] = {'baseline' : args.baseline, 'ratios' : ratios, 'regressions' : regressions}
+        prettyPrint("{0} regressions above x{1}".format(len(regressions), args.tolerance),
+                    color.RED if regressions else color.GREEN)
+
+    for filename in [args.output] + ([args.baseline] if args.save_baseline else []):
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(filename, 'w') as f:
+            json.dump(report, f, indent = 2, sort_keys = True)
+    prettyPrint("Results written to {0}".format(args.output), color.YELLOW)
@@ -10,6 +10,16 @@ import features.features as features
 from util.utils import str2tree, sick_dev_reader
 from nltk.corpus import wordnet as wn
 import features.features as features
+from collections import Counter
+from itertools import product
+from features.crossproduct import pair_counts
+from features.vectorize import FeatureVocabulary, RowBuilder
+from features.dense import DenseFeatures, FeatureMatrix
+from features.chunker import phrase_grammar, phrase_chunker
+from nltk import RegexpParser
+from features.template_profile import TemplateProfile
+from features.sentence import resize_analysis_cache
+import numpy as np
 
 class TestResult:
     def __init__(self, test_name):
@@ -126,6 +136,93 @@ def test_frame_entailment():
             break
     return result
 
+def test_sentence_analysis():
+    result = TestResult('Sentence analysis')
+    t = str2tree("( ( A ( young girl ) ) ( is dancing ) )")
+    s = features.analyze(t)
+    if features.analyze(str2tree("( ( A ( young girl ) ) ( is dancing ) )")) is not s:
+        result.add_failure("Identical sentences not shared")
+    if s.tokens != ['A', 'young', 'girl', 'is', 'dancing']:
+        result.add_failure("Tokens differ from tree leaves")
+    if s.depths != [2, 3, 3, 2, 2] or s.depth != 3:
+        result.add_failure("Word depths not computed from the tree")
+    if s != t or str(s) != str(t):
+        result.add_failure("Sentence no longer behaves like its tree")
+    resize_analysis_cache(1)
+    features.analyze(str2tree("( A ( dog barks ) )"))
+    if features.analyze(t) is s:
+        result.add_failure("Analysis cache not bounded")
+    resize_analysis_cache(50000)
+    return result
+
+def test_cross_product():
+    result = TestResult('Cross product')
+    w1 = ['a', 'dog', 'is', 'a', 'dog']
+    w2 = ['the', 'dog', 'the']
+    pairs = pair_counts(w1, w2)
+    if dict(pairs.iteritems()) != Counter(product(w1, w2)):
+        result.add_failure("Pair counts differ from the product of the tokens")
+    vocabulary = FeatureVocabulary()
+    columns = vocabulary.pair_columns(pairs)
+    if [vocabulary.feature_names[col] for col in columns] != pairs.names():
+        result.add_failure("Pair columns do not match the pair names")
+    if vocabulary.pair_columns(pair_counts(w2, w1)) != [vocabulary.column(name) for name in pair_counts(w2, w1).names()]:
+        result.add_failure("Reversed pairs share columns with the original ones")
+    if len(pair_counts([], w2)) != 0:
+        result.add_failure("Empty sentence has cross product pairs")
+    return result
+
+def test_dense_block():
+    result = TestResult('Dense block')
+    names = ['dim0', 'dim1', 'dim2']
+    builder = RowBuilder(FeatureVocabulary(), names)
+    builder.add(DenseFeatures(names, np.zeros(3)))
+    row = features.FeatureRow()
+    row.add({'b' : 2.0})
+    row.add(DenseFeatures(names, np.array([0.5, 1.5, 2.5])))
+    builder.add(row)
+    X = builder.tomatrix()
+    if not isinstance(X, FeatureMatrix) or X.dense.dtype != np.float32:
+        result.add_failure("Dense values not kept in a float32 block")
+    if X.tocsr().toarray().tolist() != [[0.0, 0.0, 0.0, 0.0], [2.0, 0.5, 1.5, 2.5]]:
+        result.add_failure("Stacked matrix differs from sparse and dense parts")
+    if row.as_dict() != {'b' : 2.0, 'dim0' : 0.5, 'dim1' : 1.5, 'dim2' : 2.5}:
+        result.add_failure("Dense features missing from the merged dict")
+    return result
+
+def test_phrase_chunker():
+    result = TestResult('Phrase chunker')
+    parser = RegexpParser(phrase_grammar)
+    for tags in (['DT', 'JJ', 'NN', 'VBZ', 'VBG', 'IN', 'DT', 'NNS'],
+                 ['RB', 'JJ', 'NN', 'IN', 'NN', 'RB', 'VBZ'],
+                 ['NNS', 'VBP', 'VBG', 'RBR', 'VBD', 'DT', 'NN', 'RB']):
+        tree = parser.parse([(str(i), tag) for i, tag in enumerate(tags)])
+        expected = {}
+        for subtree in tree.subtrees(lambda t: t.label() != 'S'):
+            leaves = [int(word) for word, tag in subtree.leaves()]
+            expected.setdefault(subtree.label(), []).append([leaves[0], leaves[-1] + 1])
+        chunks = dict((label, spans.tolist()) for label, spans in phrase_chunker.chunk(tags).items())
+        if chunks != dict((label, sorted(spans)) for label, spans in expected.items()):
+            result.add_failure("Chunks of {0} differ from RegexpParser".format(tags))
+    return result
+
+def test_template_profile():
+    result = TestResult('Template profile')
+    profile = TemplateProfile()
+    for i in range(100):
+        profile.record('slow', 0.01 if i < 98 else 1.0, 3)
+    other = TemplateProfile()
+    other.record('fast', 0.0001, 1)
+    profile.merge(other)
+    summary = profile.summary()
+    if summary['slow']['calls'] != 100 or summary['slow']['keys'] != 300 or summary['fast']['calls'] != 1:
+        result.add_failure("Calls or keys miscounted")
+    if not 0.01 <= summary['slow']['p50'] < 0.0115 or not 1.0 <= summary['slow']['p99'] < 1.15:
+        result.add_failure("Percentiles off by more than a histogram bin")
+    if profile.table().split('\n')[1].split()[0] != 'slow':
+        result.add_failure("Table not sorted by total time")
+    return result
+
 def run_feature_tests(print_results=True):
     results = []
     results.append(test_hypernyms())
@@ -134,6 +231,11 @@ def run_feature_tests(print_results=True):
     results.append(test_synset_exclusive())
     results.append(test_frame_overlap())
     results.append(test_frame_entailment())
+    results.append(test_sentence_analysis())
+    results.append(test_cross_product())
+    results.append(test_dense_block())
+    results.append(test_phrase_chunker())
+    results.append(test_template_profile())
     success = True
     for result in results:
         if print_results:
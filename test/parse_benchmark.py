@@ -0,0 +1,60 @@
+__author__ = 'chrisbillovits'
+
+'''Times util.utils.str2tree against the former regex + eval parser on a parsed SICK file,
+   and checks that both produce the same trees.'''
+
+import sys
+import os
+import re
+import csv
+import time
+
+root_dir = os.path.dirname(os.path.dirname(os.path.abspath((__file__))))
+sys.path.append(root_dir)
+os.chdir(root_dir)
+
+from argparse import ArgumentParser
+from util.utils import str2tree
+from util.colors import color, prettyPrint
+
+WORD_RE = re.compile(r"([^ \(\)]+)", re.UNICODE)
+
+def eval_str2tree(s):
+    """The previous str2tree: rewrites the bracketing as Python source and evals it."""
+    s = WORD_RE.sub(r'"\1",', s)
+    s = s.replace(")", "),").strip(",")
+    s = s.strip(",")
+    return eval(s)
+
+def read_parses(src_filename):
+    parses = []
+    for example in csv.reader(file(src_filename), delimiter="\t"):
+        if not example[0].startswith('%'):
+            parses.extend(example[1:3])
+    return parses
+
+def best_time(parser, parses, repeats):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.time()
+        for s in parses:
+            parser(s)
+        best = min(best, time.time() - start)
+    return best
+
+if __name__ == '__main__':
+    parser = ArgumentParser('description = benchmark the bracketed-parse reader')
+    parser.add_argument('--data', default = 'nli-data/SICK_test_parsed.txt', help = 'parsed SICK/SNLI file')
+    parser.add_argument('--repeats', type = int, default = 3, help = 'timing repetitions (best is kept)')
+    args = parser.parse_args()
+
+    parses = read_parses(args.data)
+    mismatches = sum(1 for s in parses if '"' not in s and str2tree(s) != eval_str2tree(s))
+    prettyPrint("{0} parses, {1} mismatches between parsers".format(len(parses), mismatches),
+                color.RED if mismatches else color.GREEN)
+
+    old = best_time(eval_str2tree, parses, args.repeats)
+    new = best_time(str2tree, parses, args.repeats)
+    prettyPrint("regex + eval: {0:.3f}s ({1:.1f} us/parse)".format(old, 1e6 * old / len(parses)), color.CYAN)
+    prettyPrint("str2tree:     {0:.3f}s ({1:.1f} us/parse)".format(new, 1e6 * new / len(parses)), color.CYAN)
+    prettyPrint("Speedup: {0:.1f}x".format(old / new), color.YELLOW)
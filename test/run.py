@@ -15,26 +15,60 @@ import logging
 from models.models import *
 from argparse import ArgumentParser
 from util.colors import color, prettyPrint
+from util.wordnet_cache import wordnet
+from features.sentence import resize_analysis_cache
+from features.features import profile_templates
+from features.template_profile import TemplateProfile
 from util import boundaryplot as bp
 from ast import literal_eval as str2dict
 from sklearn.feature_selection import SelectFpr, chi2, SelectKBest
 import sklearn
 
+# Configuration parameters that change the fitted pipeline.
+_fit_params = ('model', 'features', 'param_grid', 'plot', 'hash_bits', 'signed_hash')
 
 def run(args):
     ''' Provides a simple execution of the test harness from
         command-line invocation.  ''' 
     params = set_config(args.conf)
-    model, feat_vec, labels = train_model(params)
-    
-    load, params['load_vectors'] = params['load_vectors'], True
-    
-    test_model(params, 'train_dev', model, feat_vec, labels)
-    params['load_vectors'] = load
+    wordnet.resize(params['wordnet_cache_size'])
+    resize_analysis_cache(params['analysis_cache_size'])
+    if params['wordnet_cache_file']:
+        wordnet.load(params['wordnet_cache_file'])
+    profile = TemplateProfile() if params['profile_templates'] else None
+    profile_templates(profile)
+    model_file, config_hash, feature_hash = pipeline_tags(params)
+    if args.mode == 'evaluate':
+        model = load_pipeline(model_file, config_hash, feature_hash)
+        if model is None:
+            prettyPrint("No fitted pipeline for this configuration; run with --mode fit first.", color.RED)
+            return
+        feat_vec = labels = None
+    else:
+        model, feat_vec, labels = train_model(params)
+        save_pipeline(model, model_file, config_hash, feature_hash)
 
-    test_model(params, 'test', model, feat_vec, labels)
+    if args.mode != 'fit':
+        for data_set in args.splits:
+            test_model(params, data_set, model, feat_vec, labels)
+    prettyPrint("WordNet cache: {0}".format(wordnet.stats()), color.CYAN)
+    if params['wordnet_cache_file']:
+        wordnet.save(params['wordnet_cache_file'])
+    if profile is not None:
+        prettyPrint("Template profile:\n" + profile.table(), color.CYAN)
+        if params['profile_file']:
+            profile.save(params['profile_file'])
     prettyPrint("-" * 80, color.YELLOW)
     
+def pipeline_tags(params):
+    ''' (file name, config hash, feature cache hash) of the fitted pipeline
+        for params.  The config hash covers the parameters that change the
+        fit; the feature hash covers the feature store artifacts of the
+        training features, which change with the data and template code. '''
+    config_hash = fingerprint([(key, params[key]) for key in _fit_params])
+    feature_hash = fingerprint(feature_store.manifest(params['features'], sick_train_reader))
+    return pipeline_file(params['feature_file'], config_hash, feature_hash), config_hash, feature_hash
+
 def set_config(config_file):
     ''' Sets the configuration file.  Returns a parameter hash. '''
     params = collections.defaultdict(list)
@@ -51,8 +85,13 @@ def set_config(config_file):
 		
 		params[kv[0]] = val
         # Special-case parsing of arguments
-        for arg in ('load_vectors', 'plot'):
+        for arg in ('load_vectors', 'plot', 'signed_hash', 'profile_templates'):
             params[arg] = False if not params[arg] or not params[arg].lower() == 'true' else True
+        params['featurize_jobs'] = int(params['featurize_jobs']) if params['featurize_jobs'] else 1
+        params['chunk_size'] = int(params['chunk_size']) if params['chunk_size'] else 1000
+        params['hash_bits'] = int(params['hash_bits']) if params['hash_bits'] else None
+        params['wordnet_cache_size'] = int(params['wordnet_cache_size']) if params['wordnet_cache_size'] else 200000
+        params['analysis_cache_size'] = int(params['analysis_cache_size']) if params['analysis_cache_size'] else 50000
         prettyPrint( '{0}'.format(params), color.YELLOW)
         prettyPrint('Configuration file used: ' + config_file, color.YELLOW)
 
@@ -72,7 +111,11 @@ def train_model(params):
                                           file_name = params['feature_file'] + ".train_dev",
                                           load_vec = params['load_vectors'],
                                           feature_selector = SelectKBest(chi2, k = 'all'),
-                                          compression = compression)
+                                          compression = compression,
+                                          n_jobs = params['featurize_jobs'],
+                                          chunk_size = params['chunk_size'],
+                                          hash_bits = params['hash_bits'],
+                                          signed_hash = params['signed_hash'])
     
     best_model = parameter_tune(params['model'], model, feat_vec, labels, grid = params['param_grid'])
 
@@ -87,10 +130,14 @@ def test_model (params = None, data_set = 'test', best_model = None, feat_vec =
         prettyPrint("Generating decision boundary graph ...", color.YELLOW)
 
         filename = params['feature_file'] + '.{0}'.format(data_set)
+        vocabulary = best_model.steps[0][1].set_params(frozen = True)
         feat_vec, labels = obtain_vectors(file_extension = filename,
                                           load_vec = params['load_vectors'],
                                           reader = sick_dev_reader,
-                                          features = params['features'])                                         
+                                          features = params['features'],
+                                          n_jobs = params['featurize_jobs'],
+                                          vocabulary = vocabulary,
+                                          chunk_size = params['chunk_size'])                                         
         bp.plot_boundary(best_model, feat_vec, labels)
         prettyPrint("Saved in output/foo.png\n" + "-" * 80, color.YELLOW)
         return
@@ -101,7 +148,9 @@ def test_model (params = None, data_set = 'test', best_model = None, feat_vec =
     evaluate_model(best_model, reader = 'sick_{0}_reader'.format(data_set),
                     features = params['features'],
                     file_name = params['feature_file'],
-                    load_vec = params['load_vectors'])
+                    load_vec = params['load_vectors'],
+                    n_jobs = params['featurize_jobs'],
+                    chunk_size = params['chunk_size'])
     
     prettyPrint("Finished training and evaluating model\n" + "-" * 80, color.YELLOW)
 
@@ -109,5 +158,9 @@ if __name__ == '__main__':
     # Execute as command line
     parser = ArgumentParser('description = provide arguments for running model pipeline')
     parser.add_argument('--conf', help = 'name of configuration file ')
+    parser.add_argument('--mode', choices = ['all', 'fit', 'evaluate'], default = 'all',
+                        help = 'fit and save the pipeline, evaluate a saved one, or both')
+    parser.add_argument('--splits', nargs = '+', choices = ['train_dev', 'dev', 'test'], default = ['train_dev', 'test'],
+                        help = 'data sets to evaluate on')
     arguments = parser.parse_args()
     run(arguments)
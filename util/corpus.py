@@ -0,0 +1,240 @@
+__author__ = 'mihaileric/chrisbillovits'
+
+"""Compiled binary form of a SICK split.
+
+A split is compiled once into a directory of .npy arrays plus a string
+table: pair labels, each sentence's tree as preorder (token id, parent)
+node arrays, and its SEMAFOR frames with their labels.  Reading it back
+maps the arrays with mmap and rebuilds the usual
+(label, t1, t2, sf1, sf2) tuples, so neither the TSV, the tree parser nor
+the SEMAFOR XML is touched again until one of the source files changes.
+A tagging pass stores the POS tags of every token, which stored_tags()
+serves to the feature templates; it runs on the first tag lookup after a
+split is read, unless the split was tagged up front (see __main__)."""
+
+import os
+import sys
+import shutil
+import tempfile
+
+"""Add root directory path"""
+root_dir = os.path.dirname(os.path.dirname(__file__))
+sys.path.append(root_dir)
+
+import numpy as np
+from framenet.frame import Frame
+from util.tree import ArrayTree
+
+_arrays = ['labels', 'tree_offsets', 'node_token', 'node_parent',
+           'frame_offsets', 'frame_name', 'frame_text',
+           'label_offsets', 'label_name', 'label_text']
+
+def compiled_dir(src_filename):
+    """Directory holding the compiled form of a parsed SICK file."""
+    name = os.path.splitext(os.path.basename(src_filename))[0]
+    return os.path.join(os.path.dirname(src_filename), 'compiled', name)
+
+def _source_stamp(sources):
+    return ['{0}\t{1}\t{2}'.format(f, os.path.getsize(f), os.path.getmtime(f)) for f in sources]
+
+def is_compiled(directory, sources):
+    """True if directory holds a compilation of the current sources."""
+    stamp_file = os.path.join(directory, 'sources.txt')
+    if not os.path.isfile(stamp_file) or not all(os.path.isfile(f) for f in sources):
+        return False
+    with open(stamp_file, 'r') as f:
+        return f.read().splitlines() == _source_stamp(sources)
+
+def compile_corpus(examples, directory, sources):
+    """Writes (label, t1, t2, sf1, sf2) examples in compiled form to directory."""
+    strings, string_ids = [], {}
+    def intern(s):
+        if s not in string_ids:
+            string_ids[s] = len(strings)
+            strings.append(s)
+        return string_ids[s]
+
+    data = dict((name, []) for name in _arrays)
+    data['tree_offsets'].append(0)
+    data['frame_offsets'].append(0)
+    data['label_offsets'].append(0)
+    for label, t1, t2, sf1, sf2 in examples:
+        data['labels'].append(intern(label))
+        for t, frames in ((t1, sf1), (t2, sf2)):
+            tree = ArrayTree(t)
+            tokens = [intern(w) for w in tree.tokens]
+            data['node_token'].extend(tokens[i] if i >= 0 else -1 for i in tree.token)
+            data['node_parent'].extend(tree.parent)
+            data['tree_offsets'].append(len(data['node_parent']))
+            for frame in frames:
+                data['frame_name'].append(intern(frame.name))
+                data['frame_text'].append(intern(frame.text))
+                for name, text in frame.labels.iteritems():
+                    data['label_name'].append(intern(name))
+                    data['label_text'].append(intern(text))
+                data['label_offsets'].append(len(data['label_name']))
+            data['frame_offsets'].append(len(data['frame_name']))
+
+    # Each process writes its own temporary directory, so concurrent first
+    # readers of a split (e.g. ablation workers) never share files.
+    parent = os.path.dirname(directory)
+    if parent and not os.path.isdir(parent):
+        try:
+            os.makedirs(parent)
+        except OSError:
+            if not os.path.isdir(parent):
+                raise
+    tmp_dir = tempfile.mkdtemp(prefix = os.path.basename(directory) + '.', suffix = '.tmp', dir = parent or '.')
+    os.chmod(tmp_dir, 0755)
+    for name in _arrays:
+        np.save(os.path.join(tmp_dir, name + '.npy'), np.array(data[name], dtype = np.int32))
+    with open(os.path.join(tmp_dir, 'strings.txt'), 'w') as f:
+        f.write('\n'.join(strings))
+    with open(os.path.join(tmp_dir, 'sources.txt'), 'w') as f:
+        f.write('\n'.join(_source_stamp(sources)))
+    if os.path.isdir(directory) and not is_compiled(directory, sources):
+        shutil.rmtree(directory, ignore_errors = True)
+    try:
+        os.rename(tmp_dir, directory)
+    except OSError:
+        # Another process published its compilation first.
+        shutil.rmtree(tmp_dir, ignore_errors = True)
+        if not is_compiled(directory, sources):
+            raise
+
+def load_compiled(directory):
+    """Maps the arrays of a compiled split; returns (arrays dict, string table)."""
+    arrays = dict((name, np.load(os.path.join(directory, name + '.npy'), mmap_mode = 'r')) for name in _arrays)
+    with open(os.path.join(directory, 'strings.txt'), 'r') as f:
+        strings = f.read().split('\n')
+    return arrays, strings
+
+def _build_tree(tokens, parents, strings):
+    """Rebuilds the tuple tree from preorder (token id, parent) node arrays."""
+    children = [[] for _ in tokens]
+    for i in xrange(1, len(parents)):
+        children[parents[i]].append(i)
+    built = [None] * len(tokens)
+    for i in xrange(len(tokens) - 1, -1, -1):
+        built[i] = strings[tokens[i]] if tokens[i] >= 0 else tuple([built[c] for c in children[i]])
+    return built[0]
+
+def compiled_reader(directory):
+    """Yields (label, t1, t2, sf1, sf2) from a compiled split, like sick_reader."""
+    _read_dirs.add(os.path.abspath(directory))
+    arrays, strings = load_compiled(directory)
+    tree_offsets = arrays['tree_offsets']
+    frame_offsets, label_offsets = arrays['frame_offsets'], arrays['label_offsets']
+
+    def sentence(i):
+        start, end = tree_offsets[i], tree_offsets[i + 1]
+        tree = _build_tree(arrays['node_token'][start:end].tolist(), arrays['node_parent'][start:end].tolist(), strings)
+        frames = []
+        for j in xrange(frame_offsets[i], frame_offsets[i + 1]):
+            labels = dict((strings[name], strings[text]) for name, text in
+                          zip(arrays['label_name'][label_offsets[j]:label_offsets[j + 1]],
+                              arrays['label_text'][label_offsets[j]:label_offsets[j + 1]]))
+            frames.append(Frame.from_fields(strings[arrays['frame_name'][j]], strings[arrays['frame_text'][j]], labels))
+        return tree, frames
+
+    for i, label in enumerate(arrays['labels']):
+        t1, sf1 = sentence(2 * i)
+        t2, sf2 = sentence(2 * i + 1)
+        yield (strings[label], t1, t2, sf1, sf2)
+
+def sentence_tokens(arrays, strings):
+    """Token lists of the sentences of a compiled split, in order."""
+    node_token, tree_offsets = arrays['node_token'], arrays['tree_offsets']
+    sentences = []
+    for i in xrange(len(tree_offsets) - 1):
+        ids = node_token[tree_offsets[i]:tree_offsets[i + 1]]
+        sentences.append([strings[t] for t in ids[ids >= 0]])
+    return sentences
+
+def _publish(filename, write):
+    """Writes filename through a temporary name private to the process, so
+    processes tagging the same split at once never share a file."""
+    temporary = '{0}.{1}.tmp'.format(filename, os.getpid())
+    try:
+        with open(temporary, 'wb') as f:
+            write(f)
+        os.rename(temporary, filename)
+    finally:
+        if os.path.isfile(temporary):
+            os.remove(temporary)
+
+def _read_stamp(directory, name):
+    stamp_file = os.path.join(directory, name)
+    if not os.path.isfile(stamp_file):
+        return None
+    with open(stamp_file, 'r') as f:
+        return f.read()
+
+def is_tagged(directory):
+    """True if directory holds tags of its current compilation."""
+    stamp = _read_stamp(directory, 'tagged.txt')
+    return stamp is not None and stamp == _read_stamp(directory, 'sources.txt')
+
+def tag_corpus(directory):
+    """Tags every distinct sentence of a compiled split with one pos_tag_sents
+    call and stores the tags next to it: tags.npy holds a tag id per token,
+    in corpus order, and tagset.txt the tag names.  tagged.txt, written last,
+    copies the source stamp of the compilation that was tagged."""
+    from nltk import pos_tag_sents
+    stamp = _read_stamp(directory, 'sources.txt')
+    arrays, strings = load_compiled(directory)
+    sentences = sentence_tokens(arrays, strings)
+    unique = sorted(set(tuple(tokens) for tokens in sentences))
+    tagged = dict(zip(unique, pos_tag_sents([list(tokens) for tokens in unique])))
+    tagset = sorted(set(tag for pairs in tagged.values() for word, tag in pairs))
+    tag_ids = dict((tag, i) for i, tag in enumerate(tagset))
+    tags = np.array([tag_ids[tag] for tokens in sentences for word, tag in tagged[tuple(tokens)]], dtype = np.int32)
+    _publish(os.path.join(directory, 'tags.npy'), lambda f: np.save(f, tags))
+    _publish(os.path.join(directory, 'tagset.txt'), lambda f: f.write('\n'.join(tagset)))
+    _publish(os.path.join(directory, 'tagged.txt'), lambda f: f.write(stamp))
+
+_stored_tags = {}
+_read_dirs = set()
+_tagged_dirs = set()
+
+def _add_tags(directory):
+    """Adds the tags of a compiled split, tagging it first if its tags are
+    missing or belong to an earlier compilation."""
+    if not is_tagged(directory):
+        tag_corpus(directory)
+    arrays, strings = load_compiled(directory)
+    tags = np.load(os.path.join(directory, 'tags.npy')).tolist()
+    with open(os.path.join(directory, 'tagset.txt'), 'r') as f:
+        tagset = f.read().split('\n')
+    start = 0
+    for tokens in sentence_tokens(arrays, strings):
+        end = start + len(tokens)
+        _stored_tags.setdefault(tuple(tokens), [tagset[t] for t in tags[start:end]])
+        start = end
+    _tagged_dirs.add(directory)
+
+def stored_tags(tokens):
+    """The stored Penn tags of a corpus sentence as (word, tag) pairs, or None
+    if it is in no split read by this process.  The first miss after a split
+    is read tags it (once per compilation) and loads its tags, so later
+    misses cost a dict lookup."""
+    tags = _stored_tags.get(tuple(tokens))
+    if tags is None and len(_tagged_dirs) < len(_read_dirs):
+        for directory in sorted(_read_dirs - _tagged_dirs):
+            _add_tags(directory)
+        tags = _stored_tags.get(tuple(tokens))
+    return zip(tokens, tags) if tags is not None else None
+
+if __name__ == '__main__':
+    # Compiles every SICK split whose source files are present.
+    from util.utils import data_files, parse_sick
+    for split, sources in sorted(data_files.items()):
+        if not all(os.path.isfile(f) for f in sources):
+            print 'Skipping {0}: missing {1}'.format(split, [f for f in sources if not os.path.isfile(f)])
+            continue
+        directory = compiled_dir(sources[0])
+        if not is_compiled(directory, sources):
+            compile_corpus(parse_sick(*sources), directory, sources)
+        if not is_tagged(directory):
+            tag_corpus(directory)
+        print 'Compiled and tagged {0} in {1}'.format(split, directory)
@@ -0,0 +1,91 @@
+__author__ = 'chrisbillovits'
+
+''' Memory-mapped GloVe vectors with a hashed vocabulary index.
+
+    The first time a GloVe text file is opened it is converted into
+    [name].npy (the vector matrix) and [name].vocab (one word per line)
+    next to it.  Every later open maps the matrix read-only, so processes
+    forked for grid search or ablation share the same physical pages
+    instead of each parsing and holding their own copy.  '''
+
+import os
+import sys
+
+"""Add root directory path"""
+root_dir = os.path.dirname(os.path.dirname(__file__))
+sys.path.append(root_dir)
+
+import numpy as np
+from util.colors import color, prettyPrint
+
+def binary_paths(src_filename):
+    ''' Returns the (matrix, vocabulary) paths for a GloVe text file. '''
+    prefix = os.path.splitext(src_filename)[0]
+    return prefix + '.npy', prefix + '.vocab'
+
+def convert(src_filename):
+    ''' One-time conversion of a GloVe text file to its binary form.
+        Rows are written straight into the output file, so the text
+        is never held in memory as Python lists. '''
+    mat_filename, vocab_filename = binary_paths(src_filename)
+    with open(src_filename, 'r') as f:
+        rows = 0
+        for line in f:
+            if line.strip():
+                rows += 1
+                dim = len(line.split(' ')) - 1
+
+    mat = np.lib.format.open_memmap(mat_filename + '.tmp', mode = 'w+', dtype = np.float64, shape = (rows, dim))
+    with open(src_filename, 'r') as f, open(vocab_filename + '.tmp', 'w') as vocab:
+        i = 0
+        for line in f:
+            if not line.strip():
+                continue
+            fields = line.rstrip('\n').split(' ')
+            vocab.write(fields[0] + '\n')
+            mat[i] = np.array(fields[1:], dtype = np.float64)
+            i += 1
+    mat.flush()
+    del mat
+    # Only publish complete files, so an interrupted conversion is redone.
+    os.rename(mat_filename + '.tmp', mat_filename)
+    os.rename(vocab_filename + '.tmp', vocab_filename)
+
+class GloveStore(object):
+    ''' Read-only GloVe vectors: O(1) word lookup into a mapped matrix. '''
+
+    def __init__(self, src_filename):
+        mat_filename, vocab_filename = binary_paths(src_filename)
+        if not os.path.isfile(mat_filename) or not os.path.isfile(vocab_filename):
+            prettyPrint("Converting {0} to binary GloVe store ...".format(src_filename), color.CYAN)
+            convert(src_filename)
+
+        self.mat = np.load(mat_filename, mmap_mode = 'r')
+        with open(vocab_filename, 'r') as f:
+            self.vocab = [w.rstrip('\n') for w in f]
+        self.index = {w : i for i, w in enumerate(self.vocab)}
+        self.dim = self.mat.shape[1]
+        # Shared by every out-of-vocabulary word, so callers must not change it.
+        self.zeros = np.zeros(self.dim)
+        self.zeros.flags.writeable = False
+
+    def __contains__(self, w):
+        return w in self.index
+
+    def __len__(self):
+        return len(self.vocab)
+
+    def vector(self, w):
+        ''' Returns the vector for w, or zeros if w is out of vocabulary.
+            Both are read-only views; copy them before changing them. '''
+        i = self.index.get(w)
+        return self.zeros if i is None else self.mat[i]
+
+    def lookup(self, words):
+        ''' Batched lookup: an (n_words x dim) array, zero rows for
+            out-of-vocabulary words. '''
+        ids = np.array([self.index.get(w, -1) for w in words], dtype = np.int64)
+        vecs = np.zeros((len(ids), self.dim))
+        found = ids >= 0
+        vecs[found] = self.mat[ids[found]]
+        return vecs
@@ -0,0 +1,143 @@
+__author__ = 'chrisbillovits'
+
+''' Offline hypernym-closure index.
+
+    Every synset of every word in the SICK splits is given an integer id,
+    and its transitive hypernyms (synset.closure(hypernyms), without the
+    synset itself) are stored as a sorted id array.  The WordNet graph is
+    walked once, reusing the ancestors of hypernyms already walked, and
+    the result is saved in CSR form to output/hypernym_index.npz.
+    Hypernym questions about a sentence pair then become intersections of
+    integer arrays.  Synsets outside the indexed vocabulary are added on
+    first use.
+
+    Run "python util/hypernyms.py" to (re)build the index up front.  '''
+
+import os
+import sys
+import numpy as np
+
+"""Add root directory path"""
+root_dir = os.path.dirname(os.path.dirname(__file__))
+sys.path.append(root_dir)
+
+from util.wordnet_cache import wordnet
+from util.utils import data_files, parse_sick
+from util.corpus import compiled_dir, is_compiled, compile_corpus, load_compiled
+
+_index_file = 'output/hypernym_index.npz'
+
+class HypernymIndex(object):
+    ''' Synset names, their ids and the ancestor ids of each synset. '''
+
+    def __init__(self, names = (), indptr = None, indices = None):
+        self.names = list(names)
+        self.ids = {name : i for i, name in enumerate(self.names)}
+        # rows[i] is None until the ancestors of synset i are walked.
+        if indptr is None:
+            self.rows = [None] * len(self.names)
+        else:
+            self.rows = [indices[indptr[i]:indptr[i + 1]] for i in xrange(len(self.names))]
+
+    def __len__(self):
+        return len(self.names)
+
+    def synset_id(self, synset):
+        name = synset.name()
+        i = self.ids.get(name)
+        if i is None:
+            i = self.ids[name] = len(self.names)
+            self.names.append(name)
+            self.rows.append(None)
+        return i
+
+    def ancestors(self, synset):
+        ''' Sorted ids of all transitive hypernyms of synset. '''
+        i = self.synset_id(synset)
+        if self.rows[i] is None:
+            # Walked with a visited set, as Synset.closure does, since WordNet has
+            # a few hypernym cycles.  Only complete rows are ever stored, so a
+            # hypernym already walked contributes its row instead of being expanded.
+            seen, stack, walked = set([i]), [synset], []
+            while stack:
+                for hypernym in stack.pop().hypernyms():
+                    j = self.synset_id(hypernym)
+                    if j in seen:
+                        continue
+                    seen.add(j)
+                    if self.rows[j] is None:
+                        stack.append(hypernym)
+                    else:
+                        walked.append(self.rows[j])
+            ids = np.union1d(np.array(sorted(seen), dtype = np.int32),
+                             np.concatenate(walked) if walked else np.zeros(0, dtype = np.int32))
+            self.rows[i] = ids[ids != i].astype(np.int32)
+        return self.rows[i]
+
+    def add_words(self, words):
+        ''' Walks the hypernyms of every synset of the given words. '''
+        for word in sorted(words):
+            for synset in wordnet.synsets(word):
+                self.ancestors(synset)
+
+    def overlap(self, syns1, syns2):
+        ''' Number of distinct synsets of syns2 that are in syns1 or are
+            hypernyms of a synset of syns1. '''
+        if not syns1 or not syns2:
+            return 0
+        unique1 = dict((s.name(), s) for s in syns1).values()
+        covered = [np.array([self.synset_id(s) for s in unique1], dtype = np.int32)]
+        covered.extend(self.ancestors(s) for s in unique1)
+        ids2 = np.array([self.ids.get(s.name(), -1) for s in syns2], dtype = np.int32)
+        return np.intersect1d(np.concatenate(covered), ids2).size
+
+    def save(self, filename):
+        for name, row in zip(self.names, self.rows):
+            if row is None:
+                raise ValueError('ancestors of {0} were never computed'.format(name))
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        indptr = np.concatenate(([0], np.cumsum([len(row) for row in self.rows]))).astype(np.int64)
+        indices = np.concatenate(self.rows) if self.rows else np.zeros(0, dtype = np.int32)
+        np.savez(filename, names = np.array(self.names), indptr = indptr, indices = indices)
+
+    @classmethod
+    def load(cls, filename):
+        arrays = np.load(filename)
+        return cls(arrays['names'].tolist(), arrays['indptr'], arrays['indices'])
+
+def corpus_vocabulary():
+    ''' Set of tokens of every SICK split whose source files are present. '''
+    words = set()
+    for sources in data_files.values():
+        if not all(os.path.isfile(f) for f in sources):
+            continue
+        directory = compiled_dir(sources[0])
+        if not is_compiled(directory, sources):
+            compile_corpus(parse_sick(*sources), directory, sources)
+        arrays, strings = load_compiled(directory)
+        words.update(strings[i] for i in np.unique(arrays['node_token']) if i >= 0)
+    return words
+
+def build_index(filename = _index_file):
+    index = HypernymIndex()
+    index.add_words(corpus_vocabulary())
+    index.save(filename)
+    return index
+
+_hypernym_index = None
+
+def hypernym_index():
+    ''' The saved HypernymIndex, built over the corpus vocabulary if missing. '''
+    global _hypernym_index
+    if _hypernym_index is None:
+        if os.path.isfile(_index_file):
+            _hypernym_index = HypernymIndex.load(_index_file)
+        else:
+            _hypernym_index = build_index()
+    return _hypernym_index
+
+if __name__ == '__main__':
+    index = build_index()
+    print 'Indexed {0} synsets in {1}'.format(len(index), _index_file)
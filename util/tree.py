@@ -0,0 +1,95 @@
+__author__ = 'chrisbillovits'
+
+''' Array-backed parse trees.
+
+    An ArrayTree is built once per sentence from the tuple-of-tuples tree
+    that str2tree produces.  Nodes are numbered in preorder, so the subtree
+    of node i is the contiguous node range [i, i + size[i]) and covers the
+    token range [start[i], end[i]).  Structural questions (depths, spans,
+    phrases of more than one word) become array lookups instead of walks
+    over str(t) or re-collected leaves.  Structural hashes identify equal
+    subtrees without comparing them.  '''
+
+import hashlib
+import numpy as np
+
+class ArrayTree(object):
+    ''' Parse tree as parallel per-node arrays, in preorder:
+
+        parent  index of the parent node (-1 for the root)
+        depth   number of enclosing brackets (0 for the root)
+        token   index into tokens for leaves, -1 for internal nodes
+        size    number of nodes in the subtree
+        start, end   leaf span of the subtree, end exclusive
+    '''
+
+    def __init__(self, t):
+        tokens, parent, depth, token = [], [], [], []
+        stack = [(t, -1, 0)]
+        while stack:
+            node, par, d = stack.pop()
+            i = len(parent)
+            parent.append(par)
+            depth.append(d)
+            if isinstance(node, tuple):
+                token.append(-1)
+                stack.extend((child, i, d + 1) for child in reversed(node))
+            else:
+                token.append(len(tokens))
+                tokens.append(node)
+
+        self.tokens = tokens
+        self.parent = np.array(parent, dtype = np.int32)
+        self.depth = np.array(depth, dtype = np.int32)
+        self.token = np.array(token, dtype = np.int32)
+
+        size = np.ones(len(parent), dtype = np.int32)
+        for i in xrange(len(parent) - 1, 0, -1):
+            size[parent[i]] += size[i]
+        self.size = size
+
+        # Leaves preceding each node in preorder give the span starts.
+        leaves_before = np.concatenate(([0], np.cumsum(self.token >= 0)))
+        nodes = np.arange(len(parent))
+        self.start = leaves_before[nodes].astype(np.int32)
+        self.end = leaves_before[nodes + size].astype(np.int32)
+
+    def __len__(self):
+        return len(self.parent)
+
+    @property
+    def leaves(self):
+        ''' Node indices of the leaves, in token order. '''
+        return np.flatnonzero(self.token >= 0)
+
+    @property
+    def leaf_depths(self):
+        ''' Depth of every token. '''
+        return self.depth[self.token >= 0]
+
+    @property
+    def max_depth(self):
+        return int(self.depth.max()) if len(self.tokens) else 0
+
+    def phrases(self, min_words = 2):
+        ''' Internal nodes spanning at least min_words tokens. '''
+        return np.flatnonzero((self.token < 0) & (self.end - self.start >= min_words))
+
+    def words(self, node):
+        ''' Tokens covered by node. '''
+        return self.tokens[self.start[node]:self.end[node]]
+
+    def structural_hashes(self):
+        ''' Bottom-up hash of every subtree: equal subtrees get equal
+            values, in any tree and in any process (md5 based, as int64). '''
+        parent, token = self.parent.tolist(), self.token.tolist()
+        children = [[] for _ in parent]
+        for i in xrange(1, len(parent)):
+            children[parent[i]].append(i)
+        digests = [None] * len(parent)
+        for i in xrange(len(parent) - 1, -1, -1):
+            if token[i] >= 0:
+                digests[i] = hashlib.md5('w' + self.tokens[token[i]]).digest()
+            else:
+                digests[i] = hashlib.md5('t' + ''.join([digests[c] for c in children[i]])).digest()
+        return np.frombuffer(''.join(d[:8] for d in digests), dtype = '<i8').astype(np.int64)
@@ -8,20 +8,35 @@ import csv
 import re
 
 from semafor.process_semafor import frametuples
+from util.corpus import compiled_dir, is_compiled, compile_corpus, compiled_reader
 
 """Add root directory path"""
 root_dir = os.path.dirname(os.path.dirname(__file__))
 sys.path.append(root_dir)
 
 
-WORD_RE = re.compile(r"([^ \(\)]+)", re.UNICODE)
-
 def str2tree(s):
-    """Turns labeled bracketing s into a tree structure (tuple of tuples)"""
-    s = WORD_RE.sub(r'"\1",', s)
-    s = s.replace(")", "),").strip(",")
-    s = s.strip(",")
-    return eval(s)
+    """Turns labeled bracketing s into a tree structure (tuple of tuples).
+
+    Single pass over the bracket and word tokens with an explicit stack,
+    so tokens are never re-quoted or eval'd (words containing quotes are
+    fine).  As before, a bracketing of a single item is that item and
+    several top-level items form a tuple."""
+    stack = [[]]
+    for token in s.replace('(', ' ( ').replace(')', ' ) ').split():
+        if token == '(':
+            stack.append([])
+        elif token == ')':
+            if len(stack) == 1:
+                raise ValueError("Unbalanced brackets in parse: {0}".format(s))
+            node = tuple(stack.pop())
+            stack[-1].append(node)
+        else:
+            stack[-1].append(token)
+    if len(stack) != 1:
+        raise ValueError("Unbalanced brackets in parse: {0}".format(s))
+    top = stack[0]
+    return top[0] if len(top) == 1 else tuple(top)
 
 def leaves(t):
     """Returns all of the words (terminal nodes) in tree t"""
@@ -35,24 +50,51 @@ def leaves(t):
 
 data_dir = 'nli-data/'
 
-def sick_reader(src_filename, semafor_filename):
+def parse_sick(src_filename, semafor_filename):
+    """Reads pairs straight from the parsed TSV and the SEMAFOR XML."""
     frames = frametuples(semafor_filename)
-    curr_frame = 0
     for example in csv.reader(file(src_filename), delimiter="\t"):
         label, t1, t2 = example[:3]
         if not label.startswith('%'): # Some files use leading % for comments.
-            yield (label, str2tree(t1), str2tree(t2), frames[curr_frame][0], frames[curr_frame][1])
-            curr_frame += 1
+            sf = next(frames, None)
+            if sf is None:
+                raise ValueError('{0} has fewer sentence pairs than {1}'.format(semafor_filename, src_filename))
+            yield (label, str2tree(t1), str2tree(t2), sf[0], sf[1])
+
+def sick_reader(src_filename, semafor_filename):
+    """Yields (label, t1, t2, sf1, sf2) for every pair.  The split is
+    compiled to binary form (see util.corpus) on first read and read back
+    from there until one of its source files changes."""
+    directory = compiled_dir(src_filename)
+    sources = (src_filename, semafor_filename)
+    if not is_compiled(directory, sources):
+        compile_corpus(parse_sick(src_filename, semafor_filename), directory, sources)
+    for example in compiled_reader(directory):
+        yield example
+
+# (parsed pairs, SEMAFOR frames) read for each SICK split
+data_files = {'train' : (data_dir+"SICK_train_parsed.txt", data_dir+"semafor_train.xml"),
+              'dev' : (data_dir+"SICK_dev_parsed.txt", data_dir+"semafor_dev.xml"),
+              'test' : (data_dir+"SICK_test_parsed.txt", data_dir+"semafor_test.xml"),
+              'train_dev' : (data_dir+"SICK_train+dev_parsed.txt", data_dir+"semafor_traindev.xml")}
 
 #Readers for processing SICK datasets
 def sick_train_reader():
-    return sick_reader(src_filename=data_dir+"SICK_train_parsed.txt", semafor_filename=data_dir+"semafor_train.xml")
+    return sick_reader(*data_files['train'])
 
 def sick_dev_reader():
-    return sick_reader(src_filename=data_dir+"SICK_dev_parsed.txt", semafor_filename=data_dir+"semafor_dev.xml")
+    return sick_reader(*data_files['dev'])
 
 def sick_test_reader():
-    return sick_reader(src_filename=data_dir+"SICK_test_parsed.txt", semafor_filename=data_dir+"semafor_test.xml")
+    return sick_reader(*data_files['test'])
 
 def sick_train_dev_reader():
-    return sick_reader(src_filename=data_dir+"SICK_train+dev_parsed.txt", semafor_filename=data_dir+"semafor_traindev.xml")
+    return sick_reader(*data_files['train_dev'])
+
+_reader_splits = {sick_train_reader : 'train', sick_dev_reader : 'dev',
+                  sick_test_reader : 'test', sick_train_dev_reader : 'train_dev'}
+
+def reader_split(reader):
+    """Returns the split name ('train', 'dev', ...) of a sick_*_reader, or
+    None for any other reader."""
+    return _reader_splits.get(reader)
@@ -0,0 +1,154 @@
+__author__ = 'chrisbillovits'
+
+''' Shared, bounded cache in front of every WordNet lookup the features make.
+
+    Synsets by (word, POS), lemmas, antonyms, lowest common hypernyms and
+    path similarities all go through one LRU table with a fixed number of
+    entries and hit/miss counters.  The table can be
+    saved to disk and loaded on the next run: synsets and lemmas are
+    stored by name and looked up again in WordNet on load.  Featurizer
+    processes send the entries they add back to the parent the same way.  '''
+
+import os
+import sys
+import cPickle as pickle
+from collections import OrderedDict
+
+"""Add root directory path"""
+root_dir = os.path.dirname(os.path.dirname(__file__))
+sys.path.append(root_dir)
+
+from nltk.corpus import wordnet as wn
+from nltk.corpus.reader.wordnet import Synset, Lemma
+
+def _encode(value):
+    ''' Replaces synsets and lemmas in a cached value by their names. '''
+    if isinstance(value, Synset):
+        return ('synset', value.name())
+    if isinstance(value, Lemma):
+        return ('lemma', value.synset().name(), value.name())
+    if isinstance(value, (list, tuple)):
+        return ('seq', [_encode(v) for v in value])
+    return ('value', value)
+
+def _decode(encoded):
+    kind = encoded[0]
+    if kind == 'synset':
+        return wn.synset(encoded[1])
+    if kind == 'lemma':
+        return [l for l in wn.synset(encoded[1]).lemmas() if l.name() == encoded[2]][0]
+    if kind == 'seq':
+        return tuple(_decode(v) for v in encoded[1])
+    return encoded[1]
+
+class WordNetCache(object):
+    ''' LRU cache of WordNet lookups, keyed by plain strings. '''
+
+    def __init__(self, size = 200000):
+        self.size = size
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._added = None
+        self._counts = (0, 0)
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _get(self, key, compute):
+        try:
+            value = self._entries.pop(key)
+            self.hits += 1
+        except KeyError:
+            value = compute()
+            self.misses += 1
+            if self._added is not None:
+                self._added[key] = value
+        self._entries[key] = value
+        while len(self._entries) > self.size:
+            self._entries.popitem(last = False)
+        return value
+
+    def resize(self, size):
+        self.size = size
+        while len(self._entries) > self.size:
+            self._entries.popitem(last = False)
+
+    def clear(self):
+        self._entries.clear()
+        self.hits = self.misses = 0
+
+    def synsets(self, word, pos = None):
+        ''' wn.synsets(word, pos), as a tuple. '''
+        return self._get(('synsets', word, pos), lambda: tuple(wn.synsets(word, pos = pos)))
+
+    def lemmas(self, word):
+        return self._get(('lemmas', word), lambda: tuple(wn.lemmas(word)))
+
+    def antonyms(self, word):
+        ''' Antonyms of all the lemmas of word, in lemma order. '''
+        return self._get(('antonyms', word),
+                         lambda: tuple(a for lemma in self.lemmas(word) for a in lemma.antonyms()))
+
+    def lch(self, syn1, syn2):
+        ''' Lowest common hypernyms; symmetric, so both orders share an entry. '''
+        if syn2.name() < syn1.name():
+            syn1, syn2 = syn2, syn1
+        return self._get(('lch', syn1.name(), syn2.name()),
+                         lambda: tuple(syn1.lowest_common_hypernyms(syn2)))
+
+    def path_similarity(self, syn1, syn2):
+        return self._get(('path', syn1.name(), syn2.name()), lambda: syn1.path_similarity(syn2))
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {'entries' : len(self), 'size' : self.size, 'hits' : self.hits, 'misses' : self.misses,
+                'hit_rate' : float(self.hits) / lookups if lookups else 0.0}
+
+    def track(self):
+        ''' Starts recording the entries added and the lookups made from now on (see changes). '''
+        self._added = OrderedDict()
+        self._counts = (self.hits, self.misses)
+
+    def changes(self):
+        ''' (added entries, hits, misses) since track(), entries encoded as
+            in save, and restarts recording; before any track(), no entries
+            and the lookups since the cache was created.  A featurizer process
+            sends these back so that the parent's cache and counters include
+            its lookups. '''
+        added = [(key, _encode(value)) for key, value in (self._added or {}).iteritems()]
+        changes = (added, self.hits - self._counts[0], self.misses - self._counts[1])
+        self.track()
+        return changes
+
+    def merge(self, changes):
+        ''' Adds the changes of another process's cache. '''
+        added, hits, misses = changes
+        self.hits += hits
+        self.misses += misses
+        for key, encoded in added[-self.size:]:
+            self._entries.pop(key, None)
+            self._entries[key] = _decode(encoded)
+        self.resize(self.size)
+
+    def save(self, filename):
+        ''' Writes the entries, least recently used first. '''
+        directory = os.path.dirname(filename)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(filename, 'wb') as f:
+            pickle.dump([(key, _encode(value)) for key, value in self._entries.iteritems()],
+                        f, pickle.HIGHEST_PROTOCOL)
+
+    def load(self, filename):
+        ''' Adds the entries saved in filename, if it exists. '''
+        if not os.path.isfile(filename):
+            return
+        with open(filename, 'rb') as f:
+            entries = pickle.load(f)
+        for key, encoded in entries[-self.size:]:
+            self._entries.pop(key, None)
+            self._entries[key] = _decode(encoded)
+        self.resize(self.size)
+
+wordnet = WordNetCache()